@@ -16,11 +16,66 @@ class Settings(BaseSettings):
     storage_dir: str = Field(default=os.getenv("STORAGE_DIR", os.path.abspath(os.path.join(os.getcwd(), "data"))))
 
     database_url: str = Field(default=os.getenv("DATABASE_URL", f"sqlite:///{os.path.abspath(os.path.join(os.getcwd(), 'data', 'app.db'))}"))
+    # Comma-separated shard URLs; users are spread across them by WhatsApp id (defaults to DATABASE_URL alone)
+    database_shard_urls: Optional[str] = Field(default=os.getenv("DATABASE_SHARD_URLS"))
+    # JSON overrides written by scripts/rebalance_shards.py (defaults to STORAGE_DIR/shard_directory.json)
+    shard_directory_path: Optional[str] = Field(default=os.getenv("SHARD_DIRECTORY_PATH"))
 
     twilio_account_sid: Optional[str] = Field(default=os.getenv("TWILIO_ACCOUNT_SID"))
     twilio_auth_token: Optional[str] = Field(default=os.getenv("TWILIO_AUTH_TOKEN"))
     twilio_whatsapp_number: Optional[str] = Field(default=os.getenv("TWILIO_WHATSAPP_NUMBER"))
     public_base_url: Optional[str] = Field(default=os.getenv("PUBLIC_BASE_URL"))
+    # Point at a local Twilio stand-in instead of https://api.twilio.com (tests, staging)
+    twilio_api_base_url: Optional[str] = Field(default=os.getenv("TWILIO_API_BASE_URL"))
+
+    outbound_sender_enabled: bool = Field(default=os.getenv("OUTBOUND_SENDER_ENABLED", "true").lower() == "true")
+    outbound_rate_per_second: float = Field(default=float(os.getenv("OUTBOUND_RATE_PER_SECOND", "1.0")))
+    outbound_burst: int = Field(default=int(os.getenv("OUTBOUND_BURST", "5")))
+    outbound_max_attempts: int = Field(default=int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "5")))
+    outbound_poll_interval_seconds: float = Field(default=float(os.getenv("OUTBOUND_POLL_INTERVAL_SECONDS", "1.0")))
+
+    # Admission control: per-user media token bucket + per-stage concurrency caps
+    admission_user_rate_per_second: float = Field(default=float(os.getenv("ADMISSION_USER_RATE_PER_SECOND", "0.2")))
+    admission_user_burst: int = Field(default=int(os.getenv("ADMISSION_USER_BURST", "5")))
+    admission_download_concurrency: int = Field(default=int(os.getenv("ADMISSION_DOWNLOAD_CONCURRENCY", "8")))
+    admission_transcription_concurrency: int = Field(default=int(os.getenv("ADMISSION_TRANSCRIPTION_CONCURRENCY", "2")))
+    admission_mem0_concurrency: int = Field(default=int(os.getenv("ADMISSION_MEM0_CONCURRENCY", "8")))
+    admission_download_wait_seconds: float = Field(default=float(os.getenv("ADMISSION_DOWNLOAD_WAIT_SECONDS", "2.0")))
+    admission_transcription_wait_seconds: float = Field(default=float(os.getenv("ADMISSION_TRANSCRIPTION_WAIT_SECONDS", "1.0")))
+    admission_mem0_wait_seconds: float = Field(default=float(os.getenv("ADMISSION_MEM0_WAIT_SECONDS", "0.5")))
+
+    # Near-duplicate text memories: "merge" skips them, "tag" stores them labelled
+    text_dedup_mode: str = Field(default=os.getenv("TEXT_DEDUP_MODE", "merge"))
+    text_dedup_max_distance: int = Field(default=int(os.getenv("TEXT_DEDUP_MAX_DISTANCE", "3")))
+    text_dedup_min_tokens: int = Field(default=int(os.getenv("TEXT_DEDUP_MIN_TOKENS", "3")))
+    text_dedup_index_max_users: int = Field(default=int(os.getenv("TEXT_DEDUP_INDEX_MAX_USERS", "10000")))
+
+    # Group commit: webhook inserts from concurrent requests share one transaction per batch
+    write_coordinator_enabled: bool = Field(default=os.getenv("WRITE_COORDINATOR_ENABLED", "true").lower() == "true")
+    write_batch_max_size: int = Field(default=int(os.getenv("WRITE_BATCH_MAX_SIZE", "64")))
+    write_batch_max_wait_ms: float = Field(default=float(os.getenv("WRITE_BATCH_MAX_WAIT_MS", "5")))
+
+    # Interactions (and their memories/media rows) older than this move to compressed archive segments
+    archive_horizon_days: int = Field(default=int(os.getenv("ARCHIVE_HORIZON_DAYS", "180")))
+
+    # Per-user ring buffer of the newest memories behind plain `/list`
+    recent_cache_max_bytes: int = Field(default=int(os.getenv("RECENT_CACHE_MAX_BYTES", str(16 * 1024 * 1024))))
+    # Rings are re-read from the DB after this long, bounding staleness from writes in other workers
+    recent_cache_ttl_seconds: float = Field(default=float(os.getenv("RECENT_CACHE_TTL_SECONDS", "30")))
+    # Compare every cache hit with the DB answer (tests/staging)
+    recent_cache_verify: bool = Field(default=os.getenv("RECENT_CACHE_VERIFY", "false").lower() == "true")
+
+    # Decoded 16 kHz PCM of audio media, keyed by sha256 (0 disables the cache)
+    audio_cache_max_bytes: int = Field(default=int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))))
+
+    # GET /media: HMAC secret for signed URLs (unset: only the owner check applies), their lifetime,
+    # and an optional nginx internal location prefix to hand file transfer to the proxy
+    media_signing_secret: Optional[str] = Field(default=os.getenv("MEDIA_SIGNING_SECRET"))
+    media_url_ttl_seconds: int = Field(default=int(os.getenv("MEDIA_URL_TTL_SECONDS", "86400")))
+    media_accel_redirect_prefix: Optional[str] = Field(default=os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX"))
+
+    # How long a search waits for Mem0 before answering from the local DB search alone
+    search_deadline_ms: int = Field(default=int(os.getenv("SEARCH_DEADLINE_MS", "800")))
 
     mem0_api_key: Optional[str] = Field(default=os.getenv("MEM0_API_KEY"))
 
@@ -36,7 +91,10 @@ def get_settings() -> Settings:
     settings = Settings()  # type: ignore[arg-type]
     os.makedirs(settings.storage_dir, exist_ok=True)
     # Ensure parent dir for sqlite db exists if sqlite is used
-    if settings.database_url.startswith("sqlite"):
-        db_path = settings.database_url.split("sqlite:///")[-1]
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    urls = [settings.database_url, *(settings.database_shard_urls or "").split(",")]
+    for url in urls:
+        url = url.strip()
+        if url.startswith("sqlite"):
+            db_path = url.split("sqlite:///")[-1]
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
     return settings 
\ No newline at end of file
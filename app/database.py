@@ -1,44 +1,150 @@
 from __future__ import annotations
 
+import os
 from contextlib import contextmanager
-from typing import Generator
+from dataclasses import dataclass
+from typing import AsyncGenerator, Generator, Optional
 
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
 
 from .config import get_settings
+from .sharding import ShardRouter
 
 
 class Base(DeclarativeBase):
     pass
 
 
-def _create_engine_url() -> str:
-    return get_settings().database_url
+# Driver swaps between the sync engine (scripts, create_all, background threads)
+# and the async engine (request handlers)
+_SYNC_TO_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+_ASYNC_TO_SYNC_DRIVERS = {
+    "sqlite+aiosqlite": "sqlite",
+    "postgresql+asyncpg": "postgresql+psycopg2",
+}
 
 
-def _create_engine():
-    url = _create_engine_url()
+def _swap_driver(url: str, mapping: dict[str, str]) -> str:
+    scheme, sep, rest = url.partition("://")
+    if not sep:
+        return url
+    return f"{mapping.get(scheme, scheme)}://{rest}"
+
+
+def _shard_urls() -> list[str]:
+    settings = get_settings()
+    urls = [u.strip() for u in (settings.database_shard_urls or "").split(",") if u.strip()]
+    return urls or [settings.database_url]
+
+
+def _create_engine_url(url: Optional[str] = None) -> str:
+    return _swap_driver(url or get_settings().database_url, _ASYNC_TO_SYNC_DRIVERS)
+
+
+def _create_async_engine_url(url: Optional[str] = None) -> str:
+    return _swap_driver(url or get_settings().database_url, _SYNC_TO_ASYNC_DRIVERS)
+
+
+def _create_engine(url: Optional[str] = None):
+    url = _create_engine_url(url)
     if url.startswith("sqlite"):
         return create_engine(url, connect_args={"check_same_thread": False})
     return create_engine(url)
 
 
-engine = _create_engine()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
+def _create_async_engine(url: Optional[str] = None):
+    return create_async_engine(_create_async_engine_url(url))
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
+@dataclass
+class Shard:
+    index: int
+    url: str
+    engine: Engine
+    session_factory: sessionmaker
+    async_engine: AsyncEngine
+    async_session_factory: async_sessionmaker
+
+
+def _build_shard(index: int, url: str) -> Shard:
+    sync_engine = _create_engine(url)
+    async_engine_ = _create_async_engine(url)
+    return Shard(
+        index=index,
+        url=url,
+        engine=sync_engine,
+        session_factory=sessionmaker(autocommit=False, autoflush=False, bind=sync_engine, expire_on_commit=False),
+        async_engine=async_engine_,
+        async_session_factory=async_sessionmaker(bind=async_engine_, autoflush=False, expire_on_commit=False),
+    )
+
+
+shards: list[Shard] = [_build_shard(i, url) for i, url in enumerate(_shard_urls())]
+shard_router = ShardRouter(
+    num_shards=len(shards),
+    directory_path=get_settings().shard_directory_path or os.path.join(get_settings().storage_dir, "shard_directory.json"),
+)
+_shard_index_by_engine = {id(s.engine): s.index for s in shards}
+_shard_index_by_engine.update({id(s.async_engine.sync_engine): s.index for s in shards})
+
+# Shard 0; the only shard unless DATABASE_SHARD_URLS is set
+engine = shards[0].engine
+SessionLocal = shards[0].session_factory
+async_engine = shards[0].async_engine
+AsyncSessionLocal = shards[0].async_session_factory
+
+
+def shard_index_for_bind(bind: Engine) -> int:
+    return _shard_index_by_engine.get(id(bind), 0)
+
+
+def session_shard(db: AsyncSession) -> int:
+    return db.info.get("shard", 0)
+
+
+def create_all_shards() -> None:
+    for shard in shards:
+        Base.metadata.create_all(bind=shard.engine)
+
+
+async def _resolve_shard(request: Request) -> int:
+    if len(shards) == 1:
+        return 0
+    raw_user_id = request.path_params.get("user_id") or request.query_params.get("user_id")
+    if raw_user_id is not None:
+        try:
+            return shard_router.shard_for_user_id(int(raw_user_id))
+        except ValueError:
+            return 0
+    if request.method == "POST" and request.headers.get("content-type", "").startswith(
+        ("application/x-www-form-urlencoded", "multipart/form-data")
+    ):
+        # Starlette caches the parsed form, so the route's Form(...) params reuse it
+        form = await request.form()
+        whatsapp_user_id = form.get("WaId") or (form.get("From") or "").replace("whatsapp:", "")
+        return shard_router.shard_for_whatsapp_id(str(whatsapp_user_id))
+    return 0
+
+
+async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    # Session bound to the shard owning the request's user (`user_id` param or Twilio `WaId`)
+    index = await _resolve_shard(request)
+    async with shards[index].async_session_factory() as db:
+        db.info["shard"] = index
         yield db
-    finally:
-        db.close()
 
 
 @contextmanager
-def db_session() -> Generator[Session, None, None]:
-    session = SessionLocal()
+def db_session(shard_index: int = 0) -> Generator[Session, None, None]:
+    session = shards[shard_index].session_factory()
     try:
         yield session
         session.commit()
@@ -46,4 +152,4 @@ def db_session() -> Generator[Session, None, None]:
         session.rollback()
         raise
     finally:
-        session.close() 
\ No newline at end of file
+        session.close()
@@ -1,11 +1,15 @@
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI, Response
 
 from .config import get_settings
-from .database import Base, engine
-from .routers import webhook, memories, interactions, analytics
+from .database import create_all_shards
+from .routers import webhook, memories, interactions, analytics, media
+from .services.twilio_messaging import outbound_sender_singleton
+from .services.write_coordinator import close_write_coordinators
 
 
 def _twiml(msg: str) -> str:
@@ -13,11 +17,23 @@ def _twiml(msg: str) -> str:
     return f"<Response><Message>{safe}</Message></Response>"
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = get_settings()
+    if settings.outbound_sender_enabled:
+        outbound_sender_singleton.start()
+    try:
+        yield
+    finally:
+        await close_write_coordinators()
+        outbound_sender_singleton.stop()
+
+
 def create_app() -> FastAPI:
-    app = FastAPI(title="WhatsApp Memory Assistant")
+    app = FastAPI(title="WhatsApp Memory Assistant", lifespan=lifespan)
 
     # Ensure tables exist (for demo). For real use, prefer migrations.
-    Base.metadata.create_all(bind=engine)
+    create_all_shards()
 
     # Root handlers to satisfy Twilio validation or misconfigured callbacks
     @app.get("/")
@@ -32,6 +48,7 @@ def create_app() -> FastAPI:
     app.include_router(memories.router)
     app.include_router(interactions.router)
     app.include_router(analytics.router)
+    app.include_router(media.router)
 
     return app
 
@@ -3,16 +3,20 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import String, Integer, DateTime, ForeignKey, UniqueConstraint, Text
+from sqlalchemy import String, Integer, BigInteger, DateTime, ForeignKey, UniqueConstraint, Text, event, func, insert, select, update
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from .database import Base
+from .database import Base, shard_index_for_bind
+from .sharding import SHARD_ID_STRIDE
+
+# Sharded user ids exceed 32 bits; SQLite keeps INTEGER so the column stays the rowid alias
+_USER_ID = BigInteger().with_variant(Integer, "sqlite")
 
 
 class User(Base):
     __tablename__ = "users"
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(_USER_ID, primary_key=True, autoincrement=True)
     whatsapp_user_id: Mapped[str] = mapped_column(String(64), index=True)
     phone_number: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
     timezone: Mapped[str] = mapped_column(String(64), default="UTC")
@@ -22,6 +26,40 @@ class User(Base):
     memories: Mapped[list[Memory]] = relationship("Memory", back_populates="user")
 
 
+class IdAllocator(Base):
+    # Per-shard high-water mark of issued ids; it only grows, so ids of users moved away are never reissued
+    __tablename__ = "id_allocators"
+
+    name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    last_id: Mapped[int] = mapped_column(BigInteger)
+
+
+@event.listens_for(User, "before_insert")
+def _allocate_sharded_user_id(mapper, connection, target: User) -> None:
+    # Shard N hands out ids from [N * STRIDE, (N + 1) * STRIDE) so user ids stay globally unique.
+    # Users moved in from other shards keep their ids (set explicitly) and skip allocation.
+    if target.id is not None:
+        return
+    low = shard_index_for_bind(connection.engine) * SHARD_ID_STRIDE
+    allocators = IdAllocator.__table__
+    bumped = connection.execute(
+        update(allocators).where(allocators.c.name == "users").values(last_id=allocators.c.last_id + 1)
+    )
+    if bumped.rowcount:
+        new_id = connection.execute(select(allocators.c.last_id).where(allocators.c.name == "users")).scalar_one()
+    else:
+        # First allocation on this shard (or a database from before the allocator): start above existing users.
+        # A concurrent first insert fails on the primary key and is retried by the caller.
+        current = connection.execute(
+            select(func.max(User.id)).where(User.id >= low, User.id < low + SHARD_ID_STRIDE)
+        ).scalar()
+        new_id = max(current or 0, low) + 1
+        connection.execute(insert(allocators).values(name="users", last_id=new_id))
+    if new_id >= low + SHARD_ID_STRIDE:
+        raise RuntimeError("user id range of this shard is exhausted")
+    target.id = new_id
+
+
 class Interaction(Base):
     __tablename__ = "interactions"
     __table_args__ = (
@@ -73,15 +111,60 @@ class Memory(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
-    interaction_id: Mapped[int] = mapped_column(ForeignKey("interactions.id", ondelete="SET NULL"))
+    interaction_id: Mapped[Optional[int]] = mapped_column(ForeignKey("interactions.id", ondelete="SET NULL"), nullable=True)
 
     mem0_id: Mapped[Optional[str]] = mapped_column(String(128), index=True)
     memory_type: Mapped[str] = mapped_column(String(16))  # text/image/audio
     title: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     text: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # transcript or text
     labels_json: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # 64-bit SimHash of `text` (signed bit pattern) for near-duplicate detection
+    text_simhash: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, index=True)
 
     user: Mapped[User] = relationship("User", back_populates="memories")
-    interaction: Mapped[Interaction] = relationship("Interaction", back_populates="memory") 
\ No newline at end of file
+    interaction: Mapped[Interaction] = relationship("Interaction", back_populates="memory") 
+
+
+class OutboundMessage(Base):
+    __tablename__ = "outbound_messages"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+
+    to_phone: Mapped[str] = mapped_column(String(32))
+    from_phone: Mapped[str] = mapped_column(String(32))
+    body: Mapped[str] = mapped_column(Text)
+
+    status: Mapped[str] = mapped_column(String(16), default="queued", index=True)  # queued/sending/sent/failed (moving: claimed by a shard move)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    twilio_message_sid: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+
+    # Doubles as the claim lease while a row is `sending`
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+
+class ArchiveSegment(Base):
+    __tablename__ = "archive_segments"
+    __table_args__ = (
+        UniqueConstraint("user_id", "month", name="uq_archive_segments_user_month"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # No FK: archived users may outlive their hot rows
+    user_id: Mapped[int] = mapped_column(_USER_ID, index=True)
+    month: Mapped[str] = mapped_column(String(7))  # YYYY-MM
+    path: Mapped[str] = mapped_column(Text)
+
+    interaction_count: Mapped[int] = mapped_column(Integer, default=0)
+    memory_count: Mapped[int] = mapped_column(Integer, default=0)
+    min_occurred_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    max_occurred_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
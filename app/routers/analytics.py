@@ -1,33 +1,57 @@
 from __future__ import annotations
 
+import asyncio
 from datetime import datetime
 
-from fastapi import APIRouter, Depends
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from fastapi import APIRouter
+from sqlalchemy import func, select
 
-from ..database import get_db
+from ..database import Shard, shards
 from ..models import User, Interaction, Memory
-from ..schemas import AnalyticsSummary
+from ..schemas import AnalyticsSummary, AdmissionStats, SearchStats
+from ..services.admission import admission_controller_singleton
+from ..services.search import search_stats
 
 router = APIRouter()
 
 
-@router.get("/analytics/summary", response_model=AnalyticsSummary)
-async def analytics_summary(db: Session = Depends(get_db)):
-    total_users = db.query(func.count(User.id)).scalar() or 0
-    total_interactions = db.query(func.count(Interaction.id)).scalar() or 0
-    total_memories = db.query(func.count(Memory.id)).scalar() or 0
+async def _shard_summary(shard: Shard) -> dict:
+    async with shard.async_session_factory() as db:
+        rows = (await db.execute(select(Memory.memory_type, func.count(Memory.id)).group_by(Memory.memory_type))).all()
+        return {
+            "total_users": await db.scalar(select(func.count(User.id))) or 0,
+            "total_interactions": await db.scalar(select(func.count(Interaction.id))) or 0,
+            "total_memories": await db.scalar(select(func.count(Memory.id))) or 0,
+            "memories_by_type": {mt: cnt for mt, cnt in rows},
+            "last_ingest": await db.scalar(select(func.max(Memory.created_at))),
+        }
+
 
-    rows = db.query(Memory.memory_type, func.count(Memory.id)).group_by(Memory.memory_type).all()
-    memories_by_type = {mt: cnt for mt, cnt in rows}
+@router.get("/analytics/summary", response_model=AnalyticsSummary)
+async def analytics_summary():
+    # Scatter-gather: every shard is queried concurrently and the partial results are merged
+    parts = await asyncio.gather(*(_shard_summary(shard) for shard in shards))
 
-    last_ingest = db.query(func.max(Memory.created_at)).scalar()
+    memories_by_type: dict[str, int] = {}
+    for part in parts:
+        for memory_type, count in part["memories_by_type"].items():
+            memories_by_type[memory_type] = memories_by_type.get(memory_type, 0) + count
+    ingests = [part["last_ingest"] for part in parts if part["last_ingest"] is not None]
 
     return AnalyticsSummary(
-        total_users=total_users,
-        total_interactions=total_interactions,
-        total_memories=total_memories,
+        total_users=sum(part["total_users"] for part in parts),
+        total_interactions=sum(part["total_interactions"] for part in parts),
+        total_memories=sum(part["total_memories"] for part in parts),
         memories_by_type=memories_by_type,
-        last_ingest_time=last_ingest,
-    ) 
\ No newline at end of file
+        last_ingest_time=max(ingests) if ingests else None,
+    )
+
+
+@router.get("/analytics/admission", response_model=AdmissionStats)
+async def admission_stats():
+    return AdmissionStats(**admission_controller_singleton.snapshot())
+
+
+@router.get("/analytics/search", response_model=SearchStats)
+async def search_stats_view():
+    return SearchStats(**search_stats.snapshot())
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..database import get_db
 from ..models import Interaction
@@ -11,11 +12,11 @@ router = APIRouter()
 
 
 @router.get("/interactions/recent", response_model=list[InteractionRead])
-async def recent_interactions(limit: int = Query(10, ge=1, le=100), user_id: int = Query(...), db: Session = Depends(get_db)):
-    return (
-        db.query(Interaction)
-        .filter(Interaction.user_id == user_id)
+async def recent_interactions(limit: int = Query(10, ge=1, le=100), user_id: int = Query(...), db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(Interaction)
+        .where(Interaction.user_id == user_id)
         .order_by(Interaction.occurred_at.desc())
         .limit(limit)
-        .all()
-    ) 
\ No newline at end of file
+    )
+    return result.scalars().all() 
\ No newline at end of file
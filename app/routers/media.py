@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import mimetypes
+import os
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import get_settings
+from ..database import get_db
+from ..models import Interaction, MediaAsset
+from ..services.media import verify_media_signature
+from ..utils.file_response import RangedFileResponse, RangeNotSatisfiable, parse_byte_range
+
+router = APIRouter()
+
+# Content is addressed by its sha256, so a given URL's bytes never change; caches still must not
+# outlive the URL's signature
+_MAX_AGE_SECONDS = 31536000
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+@router.api_route("/media/{ref}", methods=["GET", "HEAD"])
+async def get_media(
+    ref: str,
+    request: Request,
+    user_id: int = Query(...),
+    expires: Optional[int] = Query(None),
+    sig: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_db),
+):
+    # `ref` is a MediaAsset id or its sha256; only the owning user may fetch it, and only with a
+    # signed URL: a bare `user_id` is chosen by the caller and proves nothing
+    settings = get_settings()
+    if not settings.media_signing_secret:
+        raise HTTPException(status_code=403, detail="media access requires MEDIA_SIGNING_SECRET")
+    if not verify_media_signature(user_id, ref, expires, sig):
+        raise HTTPException(status_code=403, detail="invalid or expired media signature")
+
+    q = select(MediaAsset).join(Interaction, MediaAsset.interaction_id == Interaction.id).where(Interaction.user_id == user_id)
+    q = q.where(MediaAsset.id == int(ref)) if ref.isdigit() else q.where(MediaAsset.sha256_hash == ref.lower())
+    asset = (await db.execute(q.limit(1))).scalars().first()
+    if asset is None or not asset.local_path:
+        raise HTTPException(status_code=404, detail="media not found")
+    try:
+        st = await run_in_threadpool(os.stat, asset.local_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="media not found")
+
+    media_type = asset.content_type or mimetypes.guess_type(asset.local_path)[0] or "application/octet-stream"
+    # Signed URLs are capabilities, so shared caches may keep them until the signature expires
+    max_age = max(0, min(_MAX_AGE_SECONDS, expires - int(time.time())))
+    headers = {
+        "Cache-Control": f"public, max-age={max_age}, immutable",
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": "inline",
+    }
+    etag = f'"{asset.sha256_hash}"' if asset.sha256_hash else None
+    if etag:
+        headers["ETag"] = etag
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+    if settings.media_accel_redirect_prefix:
+        # nginx serves the file itself (sendfile, ranges) from an `internal` location
+        relative = os.path.relpath(asset.local_path, os.path.join(settings.storage_dir, "media"))
+        headers["X-Accel-Redirect"] = f"{settings.media_accel_redirect_prefix.rstrip('/')}/{relative}"
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    size = st.st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range.strip() != etag:
+        # Representation changed (or a date validator was sent): send the whole file
+        range_header = None
+    try:
+        byte_range = parse_byte_range(range_header, size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        return RangedFileResponse(asset.local_path, 0, size, headers=headers, media_type=media_type)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return RangedFileResponse(asset.local_path, start, end - start + 1, status_code=206, headers=headers, media_type=media_type)
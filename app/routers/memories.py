@@ -1,31 +1,52 @@
 from __future__ import annotations
 
+import json
 from typing import Optional
 
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database import get_db
+from ..config import get_settings
+from ..database import get_db, session_shard, shards
 from ..models import User, Memory, Interaction
 from ..schemas import MemoryCreate, MemoryRead, SearchResponseItem
 from ..services.mem0_client import mem0_client_singleton
+from ..services.text_dedup import find_near_duplicate, text_fingerprint_index, to_signed64
+from ..services.recent_cache import recent_memory_cache
+from ..services.search import hedged_search
+from ..services.archive import archived_segment_paths, load_segment_memories
 
 router = APIRouter()
 
 
 @router.post("/memories", response_model=MemoryRead)
-async def add_memory(payload: MemoryCreate, user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def add_memory(payload: MemoryCreate, user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise ValueError("user not found")
 
-    mem0_id = mem0_client_singleton.create_memory(
+    fingerprint, duplicate = None, None
+    if payload.memory_type == "text":
+        fingerprint, duplicate = await find_near_duplicate(db, user.id, payload.text)
+    if duplicate is not None and get_settings().text_dedup_mode == "merge":
+        return duplicate
+
+    # A tagged near-duplicate still gets its own Mem0 memory, so its edited text is searchable there
+    labels = list(payload.labels or [])
+    if duplicate is not None:
+        labels.append(f"near-duplicate-of:{duplicate.id}")
+    mem0_id = await run_in_threadpool(
+        mem0_client_singleton.create_memory,
         user_external_id=user.whatsapp_user_id,
         memory_type=payload.memory_type,
         text=payload.text,
         media_path=None,
-        labels=payload.labels,
+        labels=labels or None,
     )
+    labels_json = json.dumps([f"near-duplicate-of:{duplicate.id}"]) if duplicate is not None else None
 
     memory = Memory(
         user_id=user.id,
@@ -34,46 +55,75 @@ async def add_memory(payload: MemoryCreate, user_id: int, db: Session = Depends(
         memory_type=payload.memory_type,
         title=None,
         text=payload.text,
-        labels_json=None,
+        labels_json=labels_json,
+        text_simhash=to_signed64(fingerprint) if fingerprint is not None else None,
     )
     db.add(memory)
-    db.commit()
-    db.refresh(memory)
+    await db.commit()
+    await db.refresh(memory)
+    recent_memory_cache.push(user.id, memory)
+    if fingerprint is not None:
+        text_fingerprint_index.add(user.id, memory.id, fingerprint)
     return memory
 
 
 @router.get("/memories")
-async def search_memories(query: str = Query(...), user_id: int = Query(...), db: Session = Depends(get_db)) -> list[SearchResponseItem]:
-    user = db.query(User).filter(User.id == user_id).first()
+async def search_memories(
+    response: Response,
+    query: str = Query(...),
+    user_id: int = Query(...),
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_db),
+) -> list[SearchResponseItem]:
+    user = await db.get(User, user_id)
     if not user:
         return []
 
-    results = mem0_client_singleton.search(user_external_id=user.whatsapp_user_id, query=query)
-    response: list[SearchResponseItem] = []
-
-    for r in results:
-        # Resolve memory from DB using mem0_id if available
-        mem0_id = r.get("id") if isinstance(r, dict) else None
-        memory: Optional[Memory] = None
-        if mem0_id:
-            memory = db.query(Memory).filter(Memory.mem0_id == mem0_id, Memory.user_id == user.id).first()
-        if not memory:
-            continue
+    found = await hedged_search(db, user, query, limit=limit)
+    response.headers["X-Search-Backend"] = found.backend
+    items: list[SearchResponseItem] = []
+    for hit in found.hits:
         interaction = None
-        if memory.interaction_id:
-            interaction = db.query(Interaction).filter(Interaction.id == memory.interaction_id).first()
-        response.append(
-            SearchResponseItem(memory=memory, score=r.get("score"), source_interaction=interaction)
-        )
+        if hit.memory.interaction_id:
+            interaction = await db.get(Interaction, hit.memory.interaction_id)
+        items.append(SearchResponseItem(memory=hit.memory, score=hit.score, source_interaction=interaction))
 
-    return response
+    return items
 
 
 @router.get("/memories/list", response_model=list[MemoryRead])
-async def list_memories(user_id: int, db: Session = Depends(get_db)):
-    return (
-        db.query(Memory)
-        .filter(Memory.user_id == user_id)
+async def list_memories(user_id: int, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(Memory)
+        .where(Memory.user_id == user_id)
         .order_by(Memory.created_at.desc())
-        .all()
-    ) 
\ No newline at end of file
+    )
+    return result.scalars().all() 
+
+
+@router.get("/memories/export")
+async def export_memories(user_id: int, db: AsyncSession = Depends(get_db)) -> StreamingResponse:
+    # JSONL of every memory, archived months first (oldest first), then the hot table
+    paths = await archived_segment_paths(db, user_id)
+    paths.reverse()
+    session_factory = shards[session_shard(db)].async_session_factory
+
+    async def rows():
+        for path in paths:
+            for memory in await run_in_threadpool(load_segment_memories, path):
+                yield MemoryRead.model_validate(memory).model_dump_json() + "\n"
+        # The request's session is closed once the response starts streaming
+        async with session_factory() as session:
+            last_id = 0
+            while True:
+                result = await session.execute(
+                    select(Memory).where(Memory.user_id == user_id, Memory.id > last_id).order_by(Memory.id).limit(500)
+                )
+                batch = list(result.scalars())
+                if not batch:
+                    break
+                for memory in batch:
+                    yield MemoryRead.model_validate(memory).model_dump_json() + "\n"
+                last_id = batch[-1].id
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
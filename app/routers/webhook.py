@@ -1,21 +1,46 @@
 from __future__ import annotations
 
+import json
+import time
 from typing import Optional
 
 from fastapi import APIRouter, Depends, Form, Request, Response
-from sqlalchemy import or_, and_
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database import get_db
+from ..config import get_settings
+from ..database import get_db, session_shard
 from ..models import User, Interaction, MediaAsset, Memory
 from ..services.media import download_twilio_media, compute_sha256, persist_media
-from ..services.media import compute_image_ahash_from_bytes, compute_image_ahash_from_path, hamming_distance
-from ..services.transcription import transcribe_audio_file
+from ..services.media import is_similar_image
+from ..services.transcription import transcribe_audio
 from ..services.mem0_client import mem0_client_singleton
+from ..services.admission import admission_controller_singleton, StageSaturated, SHED
+from ..services.text_dedup import find_near_duplicate, text_fingerprint_index, to_signed64
+from ..services.search import hedged_search
+from ..services.recent_cache import recent_memory_cache, verify_reply
+from ..services.write_coordinator import WriteJob, write_coordinator_for
+from ..services.archive import read_archived_memories
+from ..utils.formatting import format_memories_reply, format_memory_line
 from ..utils.time_utils import parse_natural_time_range
 
 router = APIRouter()
 
+_TRY_LATER_REPLY = "I'm receiving a lot of media right now. Please try again in a minute ⏳"
+
+# MessageSids currently being processed by this worker (Twilio retries while we are still busy)
+_inflight_sids: set[str] = set()
+
+
+class _DuplicateMessage(Exception):
+    pass
+
+
+class _DuplicateMedia(Exception):
+    pass
+
 
 def _twiml(msg: str) -> str:
     safe = (msg or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
@@ -23,31 +48,66 @@ def _twiml(msg: str) -> str:
 
 
 def _format_memories_reply(memories: list[Memory]) -> str:
-    if not memories:
-        return "No memories found."
-    lines: list[str] = []
-    for m in memories[:10]:
-        when = m.created_at.isoformat(timespec="seconds") if m.created_at else ""
-        snippet = (m.text or "").strip()
-        if len(snippet) > 120:
-            snippet = snippet[:117] + "..."
-        lines.append(f"- [{when}] ({m.memory_type}) {snippet}")
-    return "Here are your memories:\n" + "\n".join(lines)
+    return format_memories_reply([format_memory_line(m) for m in memories[:10]])
 
 
 def _format_search_reply(memories: list[Memory]) -> str:
     if not memories:
         return "No matching memories found."
-    lines: list[str] = []
-    for m in memories[:5]:
-        when = m.created_at.isoformat(timespec="seconds") if m.created_at else ""
-        snippet = (m.text or "").strip()
-        if len(snippet) > 120:
-            snippet = snippet[:117] + "..."
-        lines.append(f"- [{when}] ({m.memory_type}) {snippet}")
+    lines = [format_memory_line(m) for m in memories[:5]]
     return "Top matches:\n" + "\n".join(lines)
 
 
+async def _recent_memories(db: AsyncSession, user_id: int) -> list[Memory]:
+    result = await db.execute(
+        select(Memory).where(Memory.user_id == user_id).order_by(Memory.created_at.desc()).limit(10)
+    )
+    memories = list(result.scalars())
+    # Users with few recent memories still see their newest archived ones
+    if len(memories) < 10:
+        memories += await read_archived_memories(db, user_id, limit=10 - len(memories))
+    return memories
+
+
+def _message_writer(
+    user_id: int,
+    message_sid: Optional[str],
+    message_type: str,
+    body_text: Optional[str],
+    media_fields: Optional[dict] = None,
+    memory_fields: Optional[dict] = None,
+) -> WriteJob:
+    # All inserts for one inbound message, committed by the write coordinator together with
+    # other concurrent messages. The checks also see rows flushed earlier in the same batch.
+    async def job(session: AsyncSession) -> Optional[Memory]:
+        if message_sid:
+            existing = (await session.execute(select(Interaction.id).where(Interaction.twilio_message_sid == message_sid).limit(1))).first()
+            if existing:
+                raise _DuplicateMessage(message_sid)
+        if media_fields:
+            existing = (await session.execute(select(MediaAsset.id).where(MediaAsset.sha256_hash == media_fields["sha256_hash"]).limit(1))).first()
+            if existing:
+                raise _DuplicateMedia(media_fields["sha256_hash"])
+        interaction = Interaction(
+            user_id=user_id,
+            twilio_message_sid=message_sid,
+            message_direction="inbound",
+            message_type=message_type,
+            body_text=body_text,
+        )
+        session.add(interaction)
+        await session.flush()
+        if media_fields:
+            session.add(MediaAsset(interaction_id=interaction.id, **media_fields))
+        memory = None
+        if memory_fields:
+            memory = Memory(user_id=user_id, interaction_id=interaction.id, **memory_fields)
+            session.add(memory)
+        return memory
+
+    return job
+
+
 @router.api_route("/webhook", methods=["POST", "GET", "HEAD"])
 async def twilio_webhook(
     request: Request,
@@ -58,7 +118,7 @@ async def twilio_webhook(
     MediaUrl0: Optional[str] = Form(None),
     MediaContentType0: Optional[str] = Form(None),
     MessageSid: Optional[str] = Form(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     # Respond to Twilio console validation GET/HEAD with simple TwiML
     if request.method in ("GET", "HEAD"):
@@ -67,32 +127,39 @@ async def twilio_webhook(
     whatsapp_user_id = WaId or (From or "").replace("whatsapp:", "")
     phone_number = From or ""
 
-    # Find or create user
-    user = db.query(User).filter(User.whatsapp_user_id == whatsapp_user_id).first()
-    if not user:
+    # Find or create user (committed right away so the request holds no write transaction)
+    user = None
+    for attempt in range(3):
+        user = (await db.execute(select(User).where(User.whatsapp_user_id == whatsapp_user_id).limit(1))).scalars().first()
+        if user:
+            break
         user = User(whatsapp_user_id=whatsapp_user_id, phone_number=phone_number)
         db.add(user)
-        db.flush()
+        try:
+            await db.commit()
+            break
+        except IntegrityError:
+            # Another request took the same sharded user id; pick the next one
+            await db.rollback()
+            if attempt == 2:
+                raise
 
     # Idempotency: avoid processing same MessageSid twice
     if MessageSid:
-        existing = db.query(Interaction).filter(Interaction.twilio_message_sid == MessageSid).first()
-        if existing:
+        existing = (await db.execute(select(Interaction.id).where(Interaction.twilio_message_sid == MessageSid).limit(1))).first()
+        if existing or MessageSid in _inflight_sids:
             return Response(content=_twiml("Duplicate ignored."), media_type="application/xml; charset=utf-8")
+        _inflight_sids.add(MessageSid)
 
     body_text = (Body or "").strip()
     is_command = body_text.startswith("/")
+    message_type = "text" if (not NumMedia or int(NumMedia) == 0) else "media"
 
-    # Record interaction regardless of command/media
-    interaction = Interaction(
-        user_id=user.id,
-        twilio_message_sid=MessageSid,
-        message_direction="inbound",
-        message_type="text" if (not NumMedia or int(NumMedia) == 0) else "media",
-        body_text=Body,
-    )
-    db.add(interaction)
-    db.flush()
+    async def record(media_fields: Optional[dict] = None, memory_fields: Optional[dict] = None) -> Optional[Memory]:
+        # Interaction is recorded regardless of command/media
+        return await write_coordinator_for(session_shard(db)).submit(
+            _message_writer(user.id, MessageSid, message_type, Body, media_fields, memory_fields)
+        )
 
     # Commands: /list [range], /search <query>
     try:
@@ -101,166 +168,171 @@ async def twilio_webhook(
             arg = rest[0].strip() if rest else ""
 
             if cmd.lower() == "/list":
-                q = db.query(Memory).filter(Memory.user_id == user.id)
-                # Time range filter if provided
-                if arg:
-                    rng = parse_natural_time_range(arg, user.timezone or "UTC")
-                    if rng:
-                        start, end = rng
-                        q = q.filter(and_(Memory.created_at >= start, Memory.created_at <= end))
-                memories = q.order_by(Memory.created_at.desc()).limit(10).all()
-                reply = _format_memories_reply(memories)
-                db.commit()
+                rng = parse_natural_time_range(arg, user.timezone or "UTC") if arg else None
+                if rng is None:
+                    # Plain /list: served from the per-user ring buffer, DB only on a cold miss
+                    reply = recent_memory_cache.get_reply(user.id)
+                    if reply is None:
+                        generation = recent_memory_cache.generation(user.id)
+                        filled_at = time.monotonic()
+                        reply = recent_memory_cache.fill(user.id, await _recent_memories(db, user.id), generation, filled_at)
+                    elif get_settings().recent_cache_verify:
+                        reply = verify_reply(user.id, reply, _format_memories_reply(await _recent_memories(db, user.id)))
+                else:
+                    start, end = rng
+                    q = select(Memory).where(Memory.user_id == user.id, and_(Memory.created_at >= start, Memory.created_at <= end))
+                    memories = list((await db.execute(q.order_by(Memory.created_at.desc()).limit(10))).scalars())
+                    # Old ranges may reach into archived months
+                    if len(memories) < 10:
+                        memories += await read_archived_memories(db, user.id, start, end, limit=10 - len(memories))
+                    reply = _format_memories_reply(memories)
+                await record()
                 return Response(content=_twiml(reply), media_type="application/xml; charset=utf-8")
 
             if cmd.lower() == "/search":
                 query_text = arg
-                results: list[Memory] = []
-                # Prefer Mem0 if available
-                mem0_results = mem0_client_singleton.search(user_external_id=user.whatsapp_user_id, query=query_text)
-                if mem0_results:
-                    mem0_ids = [r.get("id") for r in mem0_results if isinstance(r, dict) and r.get("id")]
-                    if mem0_ids:
-                        results = (
-                            db.query(Memory)
-                            .filter(Memory.user_id == user.id, Memory.mem0_id.in_(mem0_ids))
-                            .order_by(Memory.created_at.desc())
-                            .limit(5)
-                            .all()
-                        )
-                # Fallback: simple DB LIKE search
-                if not results:
-                    like = f"%{query_text}%"
-                    results = (
-                        db.query(Memory)
-                        .filter(
-                            Memory.user_id == user.id,
-                            or_(Memory.text.ilike(like), Memory.title.ilike(like))
-                        )
-                        .order_by(Memory.created_at.desc())
-                        .limit(5)
-                        .all()
-                    )
-                reply = _format_search_reply(results)
-                db.commit()
+                found = await hedged_search(db, user, query_text, limit=5)
+                reply = _format_search_reply([hit.memory for hit in found.hits])
+                await record()
                 return Response(content=_twiml(reply), media_type="application/xml; charset=utf-8")
 
         # If message looks like a query (no media) handle as search
         if body_text and ("?" in body_text) and (not NumMedia or int(NumMedia) == 0):
             query_text = body_text
-            results: list[Memory] = []
-            mem0_results = mem0_client_singleton.search(user_external_id=user.whatsapp_user_id, query=query_text)
-            if mem0_results:
-                mem0_ids = [r.get("id") for r in mem0_results if isinstance(r, dict) and r.get("id")]
-                if mem0_ids:
-                    results = (
-                        db.query(Memory)
-                        .filter(Memory.user_id == user.id, Memory.mem0_id.in_(mem0_ids))
-                        .order_by(Memory.created_at.desc())
-                        .limit(5)
-                        .all()
-                    )
-            if not results:
-                like = f"%{query_text}%"
-                results = (
-                    db.query(Memory)
-                    .filter(
-                        Memory.user_id == user.id,
-                        or_(Memory.text.ilike(like), Memory.title.ilike(like))
-                    )
-                    .order_by(Memory.created_at.desc())
-                    .limit(5)
-                    .all()
-                )
-            reply = _format_search_reply(results)
-            db.commit()
+            found = await hedged_search(db, user, query_text, limit=5)
+            reply = _format_search_reply([hit.memory for hit in found.hits])
+            await record()
             return Response(content=_twiml(reply), media_type="application/xml; charset=utf-8")
 
         # Default: ingest as memory (text or media)
         memory_type = "text"
         memory_text: Optional[str] = body_text or None
         media_path: Optional[str] = None
+        media_fields: Optional[dict] = None
+        has_media = bool(NumMedia and int(NumMedia) > 0 and MediaUrl0)
+        deferred = False
+
+        # Admission control: bursts of media from one user are shed before any heavy work starts
+        if admission_controller_singleton.admit_message(whatsapp_user_id, heavy=has_media) == SHED:
+            await record()
+            return Response(content=_twiml(_TRY_LATER_REPLY), media_type="application/xml; charset=utf-8")
 
-        if NumMedia and int(NumMedia) > 0 and MediaUrl0:
+        if has_media:
             # Download media
-            content_bytes, content_type = download_twilio_media(MediaUrl0)
+            try:
+                async with admission_controller_singleton.stage("download"):
+                    content_bytes, content_type = await run_in_threadpool(download_twilio_media, MediaUrl0)
+            except StageSaturated:
+                admission_controller_singleton.record("shed_download")
+                await record()
+                return Response(content=_twiml(_TRY_LATER_REPLY), media_type="application/xml; charset=utf-8")
             if content_bytes:
-                sha256_hex = compute_sha256(content_bytes)
+                sha256_hex = await run_in_threadpool(compute_sha256, content_bytes)
                 # Dedup: exact content
-                existing_media = db.query(MediaAsset).filter(MediaAsset.sha256_hash == sha256_hex).first()
+                existing_media = (await db.execute(select(MediaAsset.id).where(MediaAsset.sha256_hash == sha256_hex).limit(1))).first()
                 if existing_media:
-                    media = existing_media
-                    media_path = existing_media.local_path
                     return Response(content=_twiml("This media is already saved ✅"), media_type="application/xml; charset=utf-8")
                 else:
                     # Perceptual dedup for images (handles recompression/resizing)
                     if content_type and "image" in content_type:
-                        new_hash = compute_image_ahash_from_bytes(content_bytes)
-                        if new_hash is not None:
-                            # Compare with user's prior image assets
-                            candidates = (
-                                db.query(MediaAsset)
+                        # Compare with user's prior image assets
+                        candidate_paths = (
+                            await db.execute(
+                                select(MediaAsset.local_path)
                                 .join(Interaction, MediaAsset.interaction_id == Interaction.id)
-                                .filter(
+                                .where(
                                     Interaction.user_id == user.id,
                                     MediaAsset.content_type.ilike("%image%"),
                                     MediaAsset.local_path.isnot(None),
                                 )
                                 .order_by(MediaAsset.id.desc())
                                 .limit(100)
-                                .all()
                             )
-                            for cand in candidates:
-                                cand_hash = compute_image_ahash_from_path(cand.local_path) if cand.local_path else None
-                                if cand_hash is None:
-                                    continue
-                                if hamming_distance(new_hash, cand_hash) <= 10:
-                                    return Response(content=_twiml("This media is already saved ✅"), media_type="application/xml; charset=utf-8")
+                        ).scalars().all()
+                        if await run_in_threadpool(is_similar_image, content_bytes, list(candidate_paths)):
+                            return Response(content=_twiml("This media is already saved ✅"), media_type="application/xml; charset=utf-8")
                     # Persist as new media if not deduped
-                    media_path = persist_media(content_bytes, sha256_hex, content_type)
-                    media = MediaAsset(
-                        interaction_id=interaction.id,
-                        media_url=MediaUrl0,
-                        local_path=media_path,
-                        content_type=content_type,
-                        sha256_hash=sha256_hex,
-                    )
-                    db.add(media)
+                    media_path = await run_in_threadpool(persist_media, content_bytes, sha256_hex, content_type)
+                    media_fields = {
+                        "media_url": MediaUrl0,
+                        "local_path": media_path,
+                        "content_type": content_type,
+                        "sha256_hash": sha256_hex,
+                    }
 
                 if content_type and "image" in content_type:
                     memory_type = "image"
                 elif content_type and ("audio" in content_type or "ogg" in content_type):
                     memory_type = "audio"
-                    # Attempt transcription
-                    transcript = transcribe_audio_file(media_path) if media_path else None
+                    # Attempt transcription; when Whisper is saturated keep the audio and defer the transcript
+                    transcript = None
+                    if media_path:
+                        try:
+                            async with admission_controller_singleton.stage("transcription"):
+                                transcript, duration = await run_in_threadpool(transcribe_audio, media_path, sha256_hex)
+                            if duration is not None:
+                                media_fields["duration_seconds"] = duration
+                        except StageSaturated:
+                            admission_controller_singleton.record("deferred_transcription")
+                            deferred = True
                     if transcript:
                         memory_text = transcript
                 else:
                     memory_type = "text"
 
-        # Create memory in Mem0
-        mem0_id = mem0_client_singleton.create_memory(
-            user_external_id=user.whatsapp_user_id,
-            memory_type=memory_type,
-            text=memory_text,
-            media_path=media_path,
-            labels=None,
-        )
+        # Near-duplicate text (forwards, chain messages, light edits): merge into or tag against the
+        # earlier memory. Captions and transcripts are not compared: the media is the memory there.
+        fingerprint, duplicate = None, None
+        if memory_type == "text" and media_fields is None:
+            fingerprint, duplicate = await find_near_duplicate(db, user.id, memory_text)
+        labels: Optional[list[str]] = None
+        if duplicate is not None:
+            if get_settings().text_dedup_mode == "merge":
+                await record()
+                return Response(content=_twiml("You already saved something very similar ✅"), media_type="application/xml; charset=utf-8")
+            labels = [f"near-duplicate-of:{duplicate.id}"]
+
+        # Create memory in Mem0; when saturated the row is stored with mem0_id NULL for later backfill
+        mem0_id: Optional[str] = None
+        try:
+            async with admission_controller_singleton.stage("mem0"):
+                mem0_id = await run_in_threadpool(
+                    mem0_client_singleton.create_memory,
+                    user_external_id=user.whatsapp_user_id,
+                    memory_type=memory_type,
+                    text=memory_text,
+                    media_path=media_path,
+                    labels=labels,
+                )
+        except StageSaturated:
+            admission_controller_singleton.record("deferred_mem0")
+            deferred = True
 
-        memory = Memory(
-            user_id=user.id,
-            interaction_id=interaction.id,
-            mem0_id=mem0_id,
-            memory_type=memory_type,
-            title=None,
-            text=memory_text,
-            labels_json=None,
+        memory = await record(
+            media_fields,
+            {
+                "mem0_id": mem0_id,
+                "memory_type": memory_type,
+                "title": None,
+                "text": memory_text,
+                "labels_json": json.dumps(labels) if labels else None,
+                "text_simhash": to_signed64(fingerprint) if fingerprint is not None else None,
+            },
         )
-        db.add(memory)
-        db.commit()
+        recent_memory_cache.push(user.id, memory)
+        if fingerprint is not None:
+            text_fingerprint_index.add(user.id, memory.id, fingerprint)
 
         # TwiML confirmation message
-        return Response(content=_twiml("Memory saved ✅"), media_type="application/xml; charset=utf-8")
+        reply = "Memory saved ✅ (some processing was deferred)" if deferred else "Memory saved ✅"
+        return Response(content=_twiml(reply), media_type="application/xml; charset=utf-8")
+    except (_DuplicateMessage, IntegrityError):
+        return Response(content=_twiml("Duplicate ignored."), media_type="application/xml; charset=utf-8")
+    except _DuplicateMedia:
+        return Response(content=_twiml("This media is already saved ✅"), media_type="application/xml; charset=utf-8")
     except Exception as exc:
-        db.rollback()
-        return Response(content=_twiml("There was an error processing your message ❌"), media_type="application/xml; charset=utf-8") 
\ No newline at end of file
+        await db.rollback()
+        return Response(content=_twiml("There was an error processing your message ❌"), media_type="application/xml; charset=utf-8")
+    finally:
+        if MessageSid:
+            _inflight_sids.discard(MessageSid) 
\ No newline at end of file
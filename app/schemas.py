@@ -70,4 +70,14 @@ class AnalyticsSummary(BaseModel):
     total_interactions: int
     total_memories: int
     memories_by_type: dict
-    last_ingest_time: Optional[datetime] 
\ No newline at end of file
+    last_ingest_time: Optional[datetime] 
+
+
+class AdmissionStats(BaseModel):
+    counters: dict
+    stages: dict
+
+
+class SearchStats(BaseModel):
+    counters: dict
+    latency_ms: dict
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from ..config import get_settings
+from ..utils.rate_limit import KeyedTokenBuckets
+
+ACCEPT = "accept"
+SHED = "shed"
+
+
+class StageSaturated(Exception):
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"stage '{stage}' is at capacity")
+        self.stage = stage
+
+
+class AdmissionController:
+    def __init__(self) -> None:
+        settings = get_settings()
+        self.user_buckets = KeyedTokenBuckets(
+            rate=settings.admission_user_rate_per_second,
+            capacity=settings.admission_user_burst,
+        )
+        self.stage_limits: dict[str, int] = {
+            "download": settings.admission_download_concurrency,
+            "transcription": settings.admission_transcription_concurrency,
+            "mem0": settings.admission_mem0_concurrency,
+        }
+        self.stage_wait_seconds: dict[str, float] = {
+            "download": settings.admission_download_wait_seconds,
+            "transcription": settings.admission_transcription_wait_seconds,
+            "mem0": settings.admission_mem0_wait_seconds,
+        }
+        # asyncio primitives are bound to the loop that first uses them, so create lazily
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Counter[str] = Counter()
+        self._counters: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def record(self, name: str) -> None:
+        self._count(name)
+
+    def admit_message(self, whatsapp_user_id: str, heavy: bool) -> str:
+        # Text is cheap and always admitted; its Mem0 call is still bounded by the `mem0` stage.
+        # Media (download + decode + transcription) spends one token from the user's bucket.
+        if not heavy:
+            self._count("accepted_text")
+            return ACCEPT
+        if self.user_buckets.try_acquire(whatsapp_user_id):
+            self._count("accepted_media")
+            return ACCEPT
+        self._count("shed_user_rate")
+        return SHED
+
+    def _semaphore(self, name: str) -> asyncio.Semaphore:
+        sem = self._semaphores.get(name)
+        if sem is None:
+            sem = asyncio.Semaphore(self.stage_limits[name])
+            self._semaphores[name] = sem
+        return sem
+
+    @asynccontextmanager
+    async def stage(self, name: str, wait_seconds: Optional[float] = None) -> AsyncIterator[None]:
+        sem = self._semaphore(name)
+        timeout = self.stage_wait_seconds[name] if wait_seconds is None else wait_seconds
+        try:
+            if timeout <= 0:
+                if sem.locked():
+                    raise asyncio.TimeoutError
+                await sem.acquire()
+            else:
+                await asyncio.wait_for(sem.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._count(f"saturated_{name}")
+            raise StageSaturated(name)
+        with self._lock:
+            self._in_flight[name] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[name] -= 1
+            sem.release()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "stages": {
+                    name: {"limit": limit, "in_flight": self._in_flight[name]}
+                    for name, limit in self.stage_limits.items()
+                },
+            }
+
+
+admission_controller_singleton = AdmissionController()
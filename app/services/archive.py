@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Iterator, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..database import db_session, shards
+from ..models import ArchiveSegment, Interaction, MediaAsset, Memory
+
+
+@dataclass
+class ArchivedMemory:
+    # Same attributes as `Memory`, so it renders through `format_memory_line` and `MemoryRead`
+    id: int
+    user_id: int
+    interaction_id: Optional[int]
+    mem0_id: Optional[str]
+    memory_type: str
+    title: Optional[str]
+    text: Optional[str]
+    labels_json: Optional[str]
+    created_at: datetime
+
+
+# --------- Segment files: appended compressed JSONL frames ---------
+
+def _zstd():
+    try:
+        import zstandard  # type: ignore
+
+        return zstandard
+    except Exception:
+        return None
+
+
+def _segment_extension() -> str:
+    return ".jsonl.zst" if _zstd() is not None else ".jsonl.gz"
+
+
+def _compress(data: bytes, path: str) -> bytes:
+    if path.endswith(".zst"):
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError("zstandard is required to write .zst archive segments")
+        return zstd.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data)
+
+
+def _open_segment(path: str):
+    if path.endswith(".zst"):
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError("zstandard is required to read .zst archive segments")
+        # Each archive run appends a new frame
+        return io.TextIOWrapper(zstd.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True), encoding="utf-8")
+    return gzip.open(path, "rt", encoding="utf-8")
+
+
+def _append_records(path: str, records: list[dict]) -> None:
+    payload = "".join(json.dumps(r, separators=(",", ":"), default=str) + "\n" for r in records).encode("utf-8")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(_compress(payload, path))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def iter_segment(path: str) -> Iterator[dict]:
+    if not os.path.exists(path):
+        return
+    with _open_segment(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _segment_path(user_id: int, month: str, extension: str) -> str:
+    return os.path.join(get_settings().storage_dir, "archive", str(user_id), f"{month}{extension}")
+
+
+def _row_dict(obj: Any) -> dict:
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
+
+
+def _parse_dt(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _archived_memory(data: dict) -> ArchivedMemory:
+    return ArchivedMemory(
+        id=data["id"],
+        user_id=data["user_id"],
+        interaction_id=data.get("interaction_id"),
+        mem0_id=data.get("mem0_id"),
+        memory_type=data["memory_type"],
+        title=data.get("title"),
+        text=data.get("text"),
+        labels_json=data.get("labels_json"),
+        created_at=_parse_dt(data.get("created_at")),
+    )
+
+
+# --------- Archival job ---------
+
+def _write_segments(db: Session, grouped: dict[tuple[int, str], list[dict]]) -> None:
+    now = datetime.utcnow()
+    for (user_id, month), records in grouped.items():
+        segment = db.execute(
+            select(ArchiveSegment).where(ArchiveSegment.user_id == user_id, ArchiveSegment.month == month)
+        ).scalars().first()
+        if segment is None:
+            segment = ArchiveSegment(user_id=user_id, month=month, path=_segment_path(user_id, month, _segment_extension()), interaction_count=0, memory_count=0)
+            db.add(segment)
+        _append_records(segment.path, records)
+        occurred = [_parse_dt(r["occurred_at"]) for r in records if r.get("occurred_at")]
+        segment.interaction_count = (segment.interaction_count or 0) + sum(1 for r in records if r.get("interaction"))
+        segment.memory_count = (segment.memory_count or 0) + sum(1 for r in records if r.get("memory"))
+        if occurred:
+            segment.min_occurred_at = min([segment.min_occurred_at, *occurred]) if segment.min_occurred_at else min(occurred)
+            segment.max_occurred_at = max([segment.max_occurred_at, *occurred]) if segment.max_occurred_at else max(occurred)
+        segment.updated_at = now
+
+
+def _archive_interaction_batch(db: Session, interactions: list[Interaction]) -> tuple[int, int, set[int]]:
+    ids = [i.id for i in interactions]
+    memories = {m.interaction_id: m for m in db.execute(select(Memory).where(Memory.interaction_id.in_(ids))).scalars()}
+    media: dict[int, list[MediaAsset]] = defaultdict(list)
+    for asset in db.execute(select(MediaAsset).where(MediaAsset.interaction_id.in_(ids))).scalars():
+        media[asset.interaction_id].append(asset)
+
+    grouped: dict[tuple[int, str], list[dict]] = defaultdict(list)
+    for interaction in interactions:
+        memory = memories.get(interaction.id)
+        grouped[(interaction.user_id, interaction.occurred_at.strftime("%Y-%m"))].append({
+            "occurred_at": interaction.occurred_at.isoformat(),
+            "interaction": _row_dict(interaction),
+            "memory": _row_dict(memory) if memory else None,
+            "media_assets": [_row_dict(a) for a in media.get(interaction.id, [])],
+        })
+    # Segments are fsynced before the rows are deleted; a crash in between only duplicates
+    # records in the archive, which readers de-duplicate (see `_record_key`)
+    _write_segments(db, grouped)
+    db.execute(delete(MediaAsset).where(MediaAsset.interaction_id.in_(ids)))
+    db.execute(delete(Memory).where(Memory.interaction_id.in_(ids)))
+    db.execute(delete(Interaction).where(Interaction.id.in_(ids)))
+    return len(ids), len(memories), {i.user_id for i in interactions}
+
+
+def _archive_orphan_memory_batch(db: Session, memories: list[Memory]) -> tuple[int, set[int]]:
+    # Memories created through the API have no interaction; archive them by created_at
+    grouped: dict[tuple[int, str], list[dict]] = defaultdict(list)
+    for memory in memories:
+        grouped[(memory.user_id, memory.created_at.strftime("%Y-%m"))].append({
+            "occurred_at": memory.created_at.isoformat(),
+            "interaction": None,
+            "memory": _row_dict(memory),
+            "media_assets": [],
+        })
+    _write_segments(db, grouped)
+    db.execute(delete(Memory).where(Memory.id.in_([m.id for m in memories])))
+    return len(memories), {m.user_id for m in memories}
+
+
+def archive_old_rows(horizon_days: Optional[int] = None, batch_size: int = 500, dry_run: bool = False) -> dict:
+    settings = get_settings()
+    horizon = settings.archive_horizon_days if horizon_days is None else horizon_days
+    cutoff = datetime.utcnow() - timedelta(days=horizon)
+    stats = {"cutoff": cutoff.isoformat(), "interactions": 0, "memories": 0, "users": 0}
+    touched_users: set[int] = set()
+
+    for shard in shards:
+        if dry_run:
+            with db_session(shard.index) as db:
+                stats["interactions"] += len(db.execute(select(Interaction.id).where(Interaction.occurred_at < cutoff)).all())
+                stats["memories"] += len(db.execute(
+                    select(Memory.id)
+                    .outerjoin(Interaction, Memory.interaction_id == Interaction.id)
+                    .where((Interaction.occurred_at < cutoff) | (Memory.interaction_id.is_(None) & (Memory.created_at < cutoff)))
+                ).all())
+            continue
+
+        while True:
+            with db_session(shard.index) as db:
+                interactions = list(db.execute(
+                    select(Interaction).where(Interaction.occurred_at < cutoff).order_by(Interaction.id).limit(batch_size)
+                ).scalars())
+                if not interactions:
+                    break
+                archived, memories, users = _archive_interaction_batch(db, interactions)
+                stats["interactions"] += archived
+                stats["memories"] += memories
+                touched_users |= users
+
+        while True:
+            with db_session(shard.index) as db:
+                memories = list(db.execute(
+                    select(Memory)
+                    .where(Memory.interaction_id.is_(None), Memory.created_at < cutoff)
+                    .order_by(Memory.id)
+                    .limit(batch_size)
+                ).scalars())
+                if not memories:
+                    break
+                archived, users = _archive_orphan_memory_batch(db, memories)
+                stats["memories"] += archived
+                touched_users |= users
+
+    if dry_run:
+        return stats
+
+    # Only affects caches of the process running the job; web workers notice vanished rows lazily
+    from .recent_cache import recent_memory_cache
+    from .text_dedup import text_fingerprint_index
+
+    for user_id in touched_users:
+        recent_memory_cache.invalidate(user_id)
+        text_fingerprint_index.invalidate(user_id)
+    stats["users"] = len(touched_users)
+    return stats
+
+
+# --------- On-demand reads ---------
+
+def _record_key(record: dict) -> tuple:
+    # Memory ids are only unique per shard, and a user moved between shards keeps old segments,
+    # so the id alone can name two different memories. Replayed records (a crash between the
+    # segment fsync and the row delete) are identical, so this key still collapses them.
+    data = record["memory"]
+    interaction = record.get("interaction") or {}
+    return (interaction.get("twilio_message_sid"), data.get("created_at"), data["id"])
+
+
+def _load_memories(paths: list[str], start: Optional[datetime], end: Optional[datetime], limit: Optional[int] = None) -> list[ArchivedMemory]:
+    # With `limit`, `paths` must be newest month first; older months are skipped once enough are found
+    seen: set[tuple] = set()
+    found: list[ArchivedMemory] = []
+    for path in paths:
+        if limit is not None and len(found) >= limit:
+            break
+        for record in iter_segment(path):
+            data = record.get("memory")
+            if not data:
+                continue
+            key = _record_key(record)
+            if key in seen:
+                continue
+            memory = _archived_memory(data)
+            if start is not None and (memory.created_at is None or memory.created_at < start):
+                continue
+            if end is not None and (memory.created_at is None or memory.created_at > end):
+                continue
+            seen.add(key)
+            found.append(memory)
+    found.sort(key=lambda m: (m.created_at or datetime.min, m.id), reverse=True)
+    return found
+
+
+async def archived_segment_paths(db: AsyncSession, user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> list[str]:
+    q = select(ArchiveSegment.path).where(ArchiveSegment.user_id == user_id)
+    if start is not None:
+        q = q.where(ArchiveSegment.month >= start.strftime("%Y-%m"))
+    if end is not None:
+        q = q.where(ArchiveSegment.month <= end.strftime("%Y-%m"))
+    return list((await db.execute(q.order_by(ArchiveSegment.month.desc()))).scalars())
+
+
+async def read_archived_memories(
+    db: AsyncSession, user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None, limit: Optional[int] = None
+) -> list[ArchivedMemory]:
+    # Newest first; segment files are only opened when the index says they overlap the range,
+    # and with `limit` only until enough memories were found in the newest months
+    paths = await archived_segment_paths(db, user_id, start, end)
+    if not paths:
+        return []
+    memories = await run_in_threadpool(_load_memories, paths, start, end, limit)
+    return memories if limit is None else memories[:limit]
+
+
+def load_segment_memories(path: str) -> list[ArchivedMemory]:
+    # Oldest first, for exports
+    memories = _load_memories([path], None, None)
+    memories.reverse()
+    return memories
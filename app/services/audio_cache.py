@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import threading
+from typing import Any, Optional
+
+from ..config import get_settings
+
+# Whisper's input format: 16 kHz mono float32
+SAMPLE_RATE = 16000
+
+
+def _numpy():
+    try:
+        import numpy  # type: ignore
+
+        return numpy
+    except Exception:
+        return None
+
+
+def decode_audio(file_path: str) -> Optional[Any]:
+    # Same decode as `whisper.load_audio`: ffmpeg to s16le PCM, scaled to [-1, 1]
+    np = _numpy()
+    if np is None:
+        return None
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", file_path,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-",
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+
+def duration_seconds(samples: Any) -> int:
+    return int(round(len(samples) / SAMPLE_RATE))
+
+
+class DecodedAudioCache:
+    # Decoded PCM as raw float32 files under `root`, one per media sha256. Reads are
+    # memory-mapped; LRU order is the file mtime, so every worker shares one cache.
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, sha256_hex: str) -> str:
+        return os.path.join(self.root, sha256_hex[:2], f"{sha256_hex}.f32")
+
+    def get(self, sha256_hex: str) -> Optional[Any]:
+        np = _numpy()
+        if np is None or self.max_bytes <= 0:
+            return None
+        path = self._path(sha256_hex)
+        try:
+            size = os.path.getsize(path)
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if size == 0:
+            return np.zeros(0, dtype=np.float32)
+        # Read-only mapping: pages come straight from the page cache, nothing is copied up front
+        return np.memmap(path, dtype=np.float32, mode="r")
+
+    def put(self, sha256_hex: str, samples: Any) -> None:
+        np = _numpy()
+        if np is None or self.max_bytes <= 0 or samples.nbytes > self.max_bytes:
+            return
+        path = self._path(sha256_hex)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.ascontiguousarray(samples, dtype=np.float32).tofile(f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += samples.nbytes
+        self._evict()
+
+    def load(self, sha256_hex: str, file_path: str) -> Optional[Any]:
+        # Cached PCM when present, else decode with ffmpeg and cache the result
+        cached = self.get(sha256_hex)
+        if cached is not None:
+            return cached
+        samples = decode_audio(file_path)
+        if samples is not None:
+            self.put(sha256_hex, samples)
+        return samples
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".f32"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self) -> None:
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._entries())
+            if self._bytes <= self.max_bytes:
+                return
+            # Other workers add files too; rescan so the total is exact before deleting
+            entries = sorted(self._entries())
+            self._bytes = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if self._bytes <= self.max_bytes:
+                    break
+                # Readers that already mapped the file keep a valid mapping after unlink
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._bytes -= size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "bytes": self._bytes}
+
+
+decoded_audio_cache = DecodedAudioCache(
+    root=os.path.join(get_settings().storage_dir, "audio_cache"),
+    max_bytes=get_settings().audio_cache_max_bytes,
+)
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import hashlib
+import hmac
 import os
+import time
 from typing import Optional, Tuple
 
 import requests
@@ -53,6 +55,32 @@ def persist_media(content_bytes: bytes, sha256_hex: str, content_type: Optional[
     return file_path
 
 
+# --------- Signed media URLs ---------
+
+def _media_signature(secret: str, user_id: int, ref: str, expires: int) -> str:
+    message = f"{user_id}:{ref}:{expires}".encode("utf-8")
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def media_url(user_id: int, ref: str, ttl_seconds: Optional[int] = None) -> str:
+    # `ref` is a MediaAsset id or sha256; unsigned URLs (no MEDIA_SIGNING_SECRET) are refused by GET /media
+    settings = get_settings()
+    path = f"{(settings.public_base_url or '').rstrip('/')}/media/{ref}?user_id={user_id}"
+    if not settings.media_signing_secret:
+        return path
+    expires = int(time.time()) + (ttl_seconds if ttl_seconds is not None else settings.media_url_ttl_seconds)
+    return f"{path}&expires={expires}&sig={_media_signature(settings.media_signing_secret, user_id, ref, expires)}"
+
+
+def verify_media_signature(user_id: int, ref: str, expires: Optional[int], sig: Optional[str]) -> bool:
+    secret = get_settings().media_signing_secret
+    if not secret:
+        return False
+    if expires is None or not sig or expires < time.time():
+        return False
+    return hmac.compare_digest(_media_signature(secret, user_id, ref, expires), sig)
+
+
 # --------- Image perceptual hash (aHash) utilities ---------
 
 def _image_to_ahash_int(img) -> Optional[int]:
@@ -99,4 +127,15 @@ def compute_image_ahash_from_path(path: str) -> Optional[int]:
 
 
 def hamming_distance(a: int, b: int) -> int:
-    return bin((a ^ b) & ((1 << 64) - 1)).count("1") 
\ No newline at end of file
+    return bin((a ^ b) & ((1 << 64) - 1)).count("1") 
+
+def is_similar_image(content_bytes: bytes, candidate_paths: list[str], max_distance: int = 10) -> bool:
+    # Blocking (PIL decodes every candidate); run it in the threadpool
+    new_hash = compute_image_ahash_from_bytes(content_bytes)
+    if new_hash is None:
+        return False
+    for path in candidate_paths:
+        cand_hash = compute_image_ahash_from_path(path)
+        if cand_hash is not None and hamming_distance(new_hash, cand_hash) <= max_distance:
+            return True
+    return False
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import Memory
+from ..utils.formatting import format_memories_reply, format_memory_line
+
+logger = logging.getLogger(__name__)
+
+# Rough per-item bookkeeping cost on top of the rendered line itself
+_ITEM_OVERHEAD_BYTES = 96
+
+
+class _UserRing:
+    __slots__ = ("items", "reply", "nbytes", "filled_at")
+
+    def __init__(self, filled_at: float) -> None:
+        # (created_at, memory_id, rendered line), newest first, at most `per_user` long
+        self.items: list[Tuple[datetime, int, str]] = []
+        self.reply: Optional[str] = None
+        self.nbytes = 0
+        # When the ring was last read from the DB; writes from other workers are only seen after that
+        self.filled_at = filled_at
+
+
+class RecentMemoryCache:
+    def __init__(self, per_user: int, max_bytes: int, ttl_seconds: float, max_generations: int = 100000) -> None:
+        self.per_user = per_user
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_generations = max_generations
+        self._users: OrderedDict[int, _UserRing] = OrderedDict()
+        self._total_bytes = 0
+        # Per-user write generation, bumped by push/invalidate whether or not the ring is warm, so a
+        # cold fill can tell that its DB snapshot raced with a write. Evicted entries raise the floor.
+        self._generations: OrderedDict[int, int] = OrderedDict()
+        self._generation_floor = 0
+        self._clock = 0
+        self._counters: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def _bump(self, user_id: int) -> None:
+        self._clock += 1
+        self._generations[user_id] = self._clock
+        self._generations.move_to_end(user_id)
+        while len(self._generations) > self.max_generations:
+            _, evicted = self._generations.popitem(last=False)
+            self._generation_floor = max(self._generation_floor, evicted)
+
+    def generation(self, user_id: int) -> int:
+        # Take before reading the DB on a cold miss and hand to `fill`
+        with self._lock:
+            return self._generations.get(user_id, self._generation_floor)
+
+    @staticmethod
+    def _item(memory: Memory) -> Tuple[datetime, int, str]:
+        return (memory.created_at or datetime.min, memory.id, format_memory_line(memory))
+
+    @staticmethod
+    def _item_bytes(item: Tuple[datetime, int, str]) -> int:
+        return len(item[2].encode("utf-8")) + _ITEM_OVERHEAD_BYTES
+
+    def _store(self, user_id: int, ring: _UserRing) -> None:
+        old = self._users.pop(user_id, None)
+        if old is not None:
+            self._total_bytes -= old.nbytes
+        ring.nbytes = sum(self._item_bytes(item) for item in ring.items)
+        self._users[user_id] = ring
+        self._total_bytes += ring.nbytes
+        while self._total_bytes > self.max_bytes and self._users:
+            _, evicted = self._users.popitem(last=False)
+            self._total_bytes -= evicted.nbytes
+            self._counters["evictions"] += 1
+
+    def get_reply(self, user_id: int) -> Optional[str]:
+        with self._lock:
+            ring = self._users.get(user_id)
+            if ring is not None and time.monotonic() - ring.filled_at > self.ttl_seconds:
+                self._users.pop(user_id)
+                self._total_bytes -= ring.nbytes
+                self._counters["expired"] += 1
+                ring = None
+            if ring is None:
+                self._counters["misses"] += 1
+                return None
+            self._users.move_to_end(user_id)
+            self._counters["hits"] += 1
+            if ring.reply is None:
+                ring.reply = format_memories_reply([line for _, _, line in ring.items])
+            return ring.reply
+
+    def fill(self, user_id: int, memories: list[Memory], generation: int, filled_at: Optional[float] = None) -> str:
+        # `memories` must be the user's newest rows, newest first (the DB answer on a cold miss), read
+        # after `generation(user_id)` returned `generation`. A write since then makes the snapshot
+        # possibly stale: the reply is still returned but the ring stays cold.
+        ring = _UserRing(time.monotonic() if filled_at is None else filled_at)
+        ring.items = [self._item(m) for m in memories[: self.per_user]]
+        ring.reply = format_memories_reply([line for _, _, line in ring.items])
+        with self._lock:
+            if self._generations.get(user_id, self._generation_floor) != generation:
+                self._counters["stale_fills"] += 1
+            else:
+                self._store(user_id, ring)
+        return ring.reply
+
+    def push(self, user_id: int, memory: Memory) -> None:
+        # Called after commit on ingest. Cold users stay cold: a partial ring would hide older rows.
+        item = self._item(memory)
+        with self._lock:
+            self._bump(user_id)
+            ring = self._users.get(user_id)
+            if ring is None:
+                return
+            items = [existing for existing in ring.items if existing[1] != memory.id]
+            items.append(item)
+            # Concurrent requests can commit out of order; keep the DB's ORDER BY created_at DESC
+            items.sort(key=lambda it: (it[0], it[1]), reverse=True)
+            updated = _UserRing(ring.filled_at)
+            updated.items = items[: self.per_user]
+            self._store(user_id, updated)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._bump(user_id)
+            ring = self._users.pop(user_id, None)
+            if ring is not None:
+                self._total_bytes -= ring.nbytes
+                self._counters["invalidations"] += 1
+
+    def record(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._users), "bytes": self._total_bytes, **self._counters}
+
+
+recent_memory_cache = RecentMemoryCache(
+    per_user=10,
+    max_bytes=get_settings().recent_cache_max_bytes,
+    ttl_seconds=get_settings().recent_cache_ttl_seconds,
+)
+
+
+@event.listens_for(Memory, "after_delete")
+def _invalidate_on_delete(mapper, connection, target: Memory) -> None:
+    recent_memory_cache.invalidate(target.user_id)
+    # A concurrent cold miss may refill from the pre-delete snapshot; drop again once committed
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("recent_cache_invalidate", set()).add(target.user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    for user_id in session.info.pop("recent_cache_invalidate", ()):
+        recent_memory_cache.invalidate(user_id)
+
+
+def verify_reply(user_id: int, cached: str, expected: str) -> str:
+    # RECENT_CACHE_VERIFY mode: the DB answer wins and the ring is rebuilt on the next miss
+    if cached == expected:
+        recent_memory_cache.record("verified")
+        return cached
+    recent_memory_cache.record("mismatches")
+    recent_memory_cache.invalidate(user_id)
+    logger.warning("recent memory cache mismatch for user %s", user_id)
+    return expected
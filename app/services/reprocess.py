@@ -0,0 +1,404 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from typing import Callable, Optional
+
+from sqlalchemy import and_, bindparam, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..database import db_session, shards
+from ..models import MediaAsset, Memory, User
+from ..utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Repairs rows left degraded by outages (Mem0 down, Whisper failures, missing image metadata).
+# Each task selects rows by predicate in id order, processes batches in a process pool and
+# writes results back in one bulk update per batch; progress is checkpointed per shard.
+
+
+@dataclass(frozen=True)
+class ReprocessTask:
+    name: str
+    description: str
+    # (db, after_id, limit) -> picklable work items, ordered by "id"
+    select: Callable[[Session, int, int], list[dict]]
+    count: Callable[[Session], int]
+    # Runs in a pool worker: item -> result dict, or None when the row could not be repaired
+    process: Callable[[dict], Optional[dict]]
+    write_back: Callable[[Session, list[dict]], int]
+    external: bool = False
+
+
+# --------- Predicates ---------
+
+def _missing_transcript():
+    return and_(Memory.memory_type == "audio", or_(Memory.text.is_(None), Memory.text == ""))
+
+
+def _missing_mem0():
+    # Audio still waiting for its transcript is synced once `transcripts` has filled the text
+    return and_(Memory.mem0_id.is_(None), or_(Memory.text.isnot(None), Memory.memory_type != "text"), ~_missing_transcript())
+
+
+def _missing_image_metadata():
+    return and_(
+        MediaAsset.content_type.ilike("%image%"),
+        MediaAsset.local_path.isnot(None),
+        or_(MediaAsset.width_px.is_(None), MediaAsset.height_px.is_(None), MediaAsset.sha256_hash == ""),
+    )
+
+
+def _missing_duration():
+    return and_(
+        or_(MediaAsset.content_type.ilike("%audio%"), MediaAsset.content_type.ilike("%ogg%")),
+        MediaAsset.local_path.isnot(None),
+        MediaAsset.duration_seconds.is_(None),
+    )
+
+
+def _count(db: Session, q) -> int:
+    return db.scalar(select(func.count()).select_from(q.subquery())) or 0
+
+
+# --------- Worker side ---------
+
+_bucket: Optional[TokenBucket] = None
+
+
+def _init_worker(rate_per_worker: float, burst: int) -> None:
+    global _bucket
+    _bucket = TokenBucket(rate_per_worker, burst) if rate_per_worker > 0 else None
+
+
+def _throttle() -> None:
+    if _bucket is not None:
+        _bucket.acquire()
+
+
+def _process_mem0(item: dict) -> Optional[dict]:
+    from .mem0_client import mem0_client_singleton
+
+    _throttle()
+    mem0_id = mem0_client_singleton.create_memory(
+        user_external_id=item["user_external_id"],
+        memory_type=item["memory_type"],
+        text=item["text"],
+        media_path=item["media_path"],
+        labels=None,
+    )
+    return {"b_id": item["id"], "b_mem0_id": mem0_id} if mem0_id else None
+
+
+def _process_transcript(item: dict) -> Optional[dict]:
+    from .text_dedup import compute_simhash, to_signed64
+    from .transcription import transcribe_audio
+
+    text, duration = transcribe_audio(item["path"], item["sha256_hash"] or None)
+    if not text:
+        return None
+    fingerprint = compute_simhash(text)
+    return {
+        "b_id": item["id"],
+        "b_text": text,
+        "b_text_simhash": to_signed64(fingerprint) if fingerprint is not None else None,
+        "b_media_id": item["media_id"],
+        "b_duration": duration,
+    }
+
+
+def _process_image(item: dict) -> Optional[dict]:
+    try:
+        from PIL import Image
+    except Exception:
+        return None
+    try:
+        with Image.open(item["path"]) as img:
+            width, height = img.size
+        sha256_hash = item["sha256_hash"]
+        if not sha256_hash:
+            hasher = hashlib.sha256()
+            with open(item["path"], "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    hasher.update(chunk)
+            sha256_hash = hasher.hexdigest()
+    except Exception:
+        return None
+    return {"b_id": item["id"], "b_width": width, "b_height": height, "b_sha256": sha256_hash}
+
+
+def _process_duration(item: dict) -> Optional[dict]:
+    from .audio_cache import decode_audio, decoded_audio_cache, duration_seconds
+
+    sha256_hash = item["sha256_hash"]
+    samples = decoded_audio_cache.load(sha256_hash, item["path"]) if sha256_hash else decode_audio(item["path"])
+    if samples is None:
+        return None
+    return {"b_id": item["id"], "b_duration": duration_seconds(samples)}
+
+
+def _run_item(args: tuple[str, dict]) -> Optional[dict]:
+    name, item = args
+    try:
+        return TASKS[name].process(item)
+    except Exception:
+        return None
+
+
+# --------- Selection and write-back (main process) ---------
+
+def _select_mem0(db: Session, after_id: int, limit: int) -> list[dict]:
+    first_media = (
+        select(MediaAsset.local_path)
+        .where(MediaAsset.interaction_id == Memory.interaction_id)
+        .order_by(MediaAsset.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    rows = db.execute(
+        select(Memory.id, Memory.memory_type, Memory.text, User.whatsapp_user_id, first_media.label("media_path"))
+        .join(User, Memory.user_id == User.id)
+        .where(_missing_mem0(), Memory.id > after_id)
+        .order_by(Memory.id)
+        .limit(limit)
+    ).all()
+    return [
+        {"id": r.id, "memory_type": r.memory_type, "text": r.text, "user_external_id": r.whatsapp_user_id, "media_path": r.media_path}
+        for r in rows
+    ]
+
+
+def _write_mem0(db: Session, results: list[dict]) -> int:
+    # Conditional per row: a memory repaired meanwhile (e.g. by the webhook) is left alone
+    stmt = (
+        update(Memory.__table__)
+        .where(Memory.__table__.c.id == bindparam("b_id"), Memory.__table__.c.mem0_id.is_(None))
+        .values(mem0_id=bindparam("b_mem0_id"))
+    )
+    return db.execute(stmt, results).rowcount
+
+
+def _select_transcripts(db: Session, after_id: int, limit: int) -> list[dict]:
+    rows = db.execute(
+        select(Memory.id, MediaAsset.id.label("media_id"), MediaAsset.local_path, MediaAsset.sha256_hash)
+        .join(MediaAsset, MediaAsset.interaction_id == Memory.interaction_id)
+        .where(_missing_transcript(), MediaAsset.local_path.isnot(None), Memory.id > after_id)
+        .order_by(Memory.id)
+        .limit(limit)
+    ).all()
+    items: dict[int, dict] = {}
+    for r in rows:
+        items.setdefault(r.id, {"id": r.id, "media_id": r.media_id, "path": r.local_path, "sha256_hash": r.sha256_hash})
+    return list(items.values())
+
+
+def _count_transcripts(db: Session) -> int:
+    return _count(db, select(Memory.id).where(_missing_transcript(), Memory.interaction_id.isnot(None)))
+
+
+def _write_transcripts(db: Session, results: list[dict]) -> int:
+    memories = Memory.__table__
+    media = MediaAsset.__table__
+    updated = db.execute(
+        update(memories)
+        .where(memories.c.id == bindparam("b_id"), or_(memories.c.text.is_(None), memories.c.text == ""))
+        # A Mem0 memory created before the transcript has no text: clear the id so `mem0` re-syncs it
+        .values(text=bindparam("b_text"), text_simhash=bindparam("b_text_simhash"), mem0_id=None),
+        results,
+    ).rowcount
+    with_duration = [r for r in results if r["b_duration"] is not None]
+    if with_duration:
+        db.execute(
+            update(media)
+            .where(media.c.id == bindparam("b_media_id"), media.c.duration_seconds.is_(None))
+            .values(duration_seconds=bindparam("b_duration")),
+            with_duration,
+        )
+    return updated
+
+
+def _media_items(db: Session, predicate, after_id: int, limit: int) -> list[dict]:
+    rows = db.execute(
+        select(MediaAsset.id, MediaAsset.local_path, MediaAsset.sha256_hash)
+        .where(predicate, MediaAsset.id > after_id)
+        .order_by(MediaAsset.id)
+        .limit(limit)
+    ).all()
+    return [{"id": r.id, "path": r.local_path, "sha256_hash": r.sha256_hash} for r in rows]
+
+
+def _write_images(db: Session, results: list[dict]) -> int:
+    # A recomputed hash may already belong to another row (the same file stored twice); sha256_hash
+    # is unique, so those rows only get their dimensions and keep matching the task for inspection
+    media = MediaAsset.__table__
+    owners = dict(db.execute(
+        select(media.c.sha256_hash, media.c.id).where(media.c.sha256_hash.in_({r["b_sha256"] for r in results}))
+    ).all())
+    with_hash: list[dict] = []
+    colliding: list[dict] = []
+    for r in results:
+        owner = owners.setdefault(r["b_sha256"], r["b_id"])
+        (with_hash if owner == r["b_id"] else colliding).append(r)
+    updated = 0
+    if with_hash:
+        updated = db.execute(
+            update(media)
+            .where(media.c.id == bindparam("b_id"))
+            .values(width_px=bindparam("b_width"), height_px=bindparam("b_height"), sha256_hash=bindparam("b_sha256")),
+            with_hash,
+        ).rowcount
+    if colliding:
+        db.execute(
+            update(media)
+            .where(media.c.id == bindparam("b_id"))
+            .values(width_px=bindparam("b_width"), height_px=bindparam("b_height")),
+            colliding,
+        )
+        logger.warning(
+            "image_metadata: sha256 of media %s already stored on media %s; hash left empty",
+            [r["b_id"] for r in colliding], [owners[r["b_sha256"]] for r in colliding],
+        )
+    return updated
+
+
+def _write_durations(db: Session, results: list[dict]) -> int:
+    media = MediaAsset.__table__
+    return db.execute(
+        update(media)
+        .where(media.c.id == bindparam("b_id"), media.c.duration_seconds.is_(None))
+        .values(duration_seconds=bindparam("b_duration")),
+        results,
+    ).rowcount
+
+
+TASKS: dict[str, ReprocessTask] = {
+    task.name: task
+    for task in (
+        ReprocessTask(
+            name="mem0",
+            description="memories with mem0_id IS NULL (Mem0 outage or saturation)",
+            select=_select_mem0,
+            count=lambda db: _count(db, select(Memory.id).where(_missing_mem0())),
+            process=_process_mem0,
+            write_back=_write_mem0,
+            external=True,
+        ),
+        ReprocessTask(
+            name="transcripts",
+            description="audio memories with empty text",
+            select=_select_transcripts,
+            count=_count_transcripts,
+            process=_process_transcript,
+            write_back=_write_transcripts,
+        ),
+        ReprocessTask(
+            name="image_metadata",
+            description="images without width/height or sha256",
+            select=lambda db, after_id, limit: _media_items(db, _missing_image_metadata(), after_id, limit),
+            count=lambda db: _count(db, select(MediaAsset.id).where(_missing_image_metadata())),
+            process=_process_image,
+            write_back=_write_images,
+        ),
+        ReprocessTask(
+            name="audio_durations",
+            description="audio media without duration_seconds",
+            select=lambda db, after_id, limit: _media_items(db, _missing_duration(), after_id, limit),
+            count=lambda db: _count(db, select(MediaAsset.id).where(_missing_duration())),
+            process=_process_duration,
+            write_back=_write_durations,
+        ),
+    )
+}
+
+
+# --------- Checkpoints ---------
+
+def _checkpoint_path(name: str) -> str:
+    return os.path.join(get_settings().storage_dir, "reprocess", f"{name}.json")
+
+
+def load_checkpoint(name: str) -> dict:
+    try:
+        with open(_checkpoint_path(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"shards": {}}
+
+
+def _save_checkpoint(name: str, checkpoint: dict) -> None:
+    path = _checkpoint_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+# --------- Driver ---------
+
+def run_task(
+    name: str,
+    workers: int = 4,
+    batch_size: int = 200,
+    rate_per_second: float = 5.0,
+    dry_run: bool = False,
+    restart: bool = False,
+    progress: Callable[[dict], None] = lambda _: None,
+) -> dict:
+    task = TASKS[name]
+    checkpoint = {"shards": {}} if restart else load_checkpoint(name)
+    stats = {"task": name, "matching": 0, "processed": 0, "updated": 0, "failed": 0}
+
+    if dry_run:
+        for shard in shards:
+            with db_session(shard.index) as db:
+                stats["matching"] += task.count(db)
+        return stats
+
+    # External calls share one budget: each worker gets an equal slice of the rate
+    rate_per_worker = rate_per_second / workers if task.external else 0.0
+    started = time.monotonic()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(rate_per_worker, 1),
+    ) as pool:
+        for shard in shards:
+            state = checkpoint["shards"].setdefault(str(shard.index), {"last_id": 0})
+            with db_session(shard.index) as db:
+                stats["matching"] += task.count(db)
+            while True:
+                with db_session(shard.index) as db:
+                    items = task.select(db, state["last_id"], batch_size)
+                if not items:
+                    break
+                results = list(pool.map(_run_item, [(name, item) for item in items], chunksize=max(1, len(items) // (workers * 4))))
+                repaired = [r for r in results if r is not None]
+                updated = 0
+                if repaired:
+                    try:
+                        with db_session(shard.index) as db:
+                            updated = task.write_back(db, repaired)
+                    except IntegrityError:
+                        # The batch was rolled back; count it as failed rather than abort the run
+                        logger.exception("%s: write-back of batch after id %s failed", name, state["last_id"])
+                        repaired = []
+                # Rows that failed stay behind the checkpoint; `restart` retries them
+                state["last_id"] = items[-1]["id"]
+                stats["processed"] += len(items)
+                stats["updated"] += updated
+                stats["failed"] += len(items) - len(repaired)
+                _save_checkpoint(name, checkpoint)
+                elapsed = time.monotonic() - started
+                progress({**stats, "shard": shard.index, "last_id": state["last_id"], "rows_per_second": stats["processed"] / elapsed if elapsed else 0.0})
+    return stats
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import get_settings
+from ..models import Memory, User
+from .admission import StageSaturated, admission_controller_singleton
+from .mem0_client import mem0_client_singleton
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = {
+    "the", "and", "for", "are", "was", "were", "what", "when", "where", "which", "who", "why", "how",
+    "did", "does", "with", "that", "this", "have", "has", "had", "you", "your", "about", "from", "can",
+}
+_LOCAL_CANDIDATES = 50
+
+
+@dataclass
+class SearchHit:
+    memory: Memory
+    score: Optional[float] = None
+
+
+@dataclass
+class SearchResult:
+    hits: list[SearchHit] = field(default_factory=list)
+    # "mem0": Mem0 answered within the deadline and its ranking leads; "local": DB results only
+    backend: str = "local"
+    elapsed_ms: float = 0.0
+
+
+class SearchStats:
+    def __init__(self, window: int = 1000) -> None:
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=window)
+        self.counters: dict[str, int] = {}
+
+    def record(self, outcome: str, elapsed_ms: float) -> None:
+        with self._lock:
+            self.counters[outcome] = self.counters.get(outcome, 0) + 1
+            self._latencies.append(elapsed_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self.counters)
+
+        def pct(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+
+        return {"counters": counters, "latency_ms": {"p50": pct(0.5), "p99": pct(0.99), "samples": len(latencies)}}
+
+
+search_stats = SearchStats()
+
+
+def _query_terms(query: str) -> list[str]:
+    terms = []
+    for token in _TOKEN_RE.findall(query.lower()):
+        if len(token) >= 3 and token not in _STOPWORDS and token not in terms:
+            terms.append(token)
+    return terms[:8]
+
+
+async def _local_search(db: AsyncSession, user_id: int, query: str, limit: int) -> list[SearchHit]:
+    # Substring match on any query term, ranked by matched terms then recency
+    terms = _query_terms(query) or [query.strip().lower()]
+    conditions = []
+    for term in terms:
+        like = f"%{term}%"
+        conditions.extend([Memory.text.ilike(like), Memory.title.ilike(like)])
+    rows = list(
+        (
+            await db.execute(
+                select(Memory)
+                .where(Memory.user_id == user_id, or_(*conditions))
+                .order_by(Memory.created_at.desc())
+                .limit(_LOCAL_CANDIDATES)
+            )
+        ).scalars()
+    )
+
+    def matched(memory: Memory) -> int:
+        haystack = f"{memory.title or ''} {memory.text or ''}".lower()
+        return sum(1 for term in terms if term in haystack)
+
+    rows.sort(key=matched, reverse=True)
+    return [SearchHit(memory=m) for m in rows[:limit]]
+
+
+async def _mem0_search(whatsapp_user_id: str, query: str) -> Optional[list[dict]]:
+    # Skip Mem0 when its stage is saturated (None, unlike an empty answer); the local results answer instead
+    try:
+        async with admission_controller_singleton.stage("mem0"):
+            return await run_in_threadpool(mem0_client_singleton.search, user_external_id=whatsapp_user_id, query=query)
+    except StageSaturated:
+        return None
+
+
+async def _resolve_mem0(db: AsyncSession, user_id: int, results: list[dict]) -> list[SearchHit]:
+    # Keep Mem0's order; tag-mode near-duplicates share a mem0_id and collapse to one hit
+    ranked = [(r["id"], r.get("score")) for r in results if isinstance(r, dict) and r.get("id")]
+    if not ranked:
+        return []
+    rows = (
+        await db.execute(
+            select(Memory)
+            .where(Memory.user_id == user_id, Memory.mem0_id.in_([mem0_id for mem0_id, _ in ranked]))
+            .order_by(Memory.created_at.desc())
+        )
+    ).scalars()
+    by_mem0_id: dict[str, Memory] = {}
+    for memory in rows:
+        by_mem0_id.setdefault(memory.mem0_id, memory)
+    hits = []
+    for mem0_id, score in ranked:
+        memory = by_mem0_id.pop(mem0_id, None)
+        if memory is not None:
+            hits.append(SearchHit(memory=memory, score=score))
+    return hits
+
+
+def _merge(primary: list[SearchHit], secondary: list[SearchHit], limit: int) -> list[SearchHit]:
+    merged: list[SearchHit] = []
+    seen_ids: set[int] = set()
+    seen_mem0: set[str] = set()
+    for hit in [*primary, *secondary]:
+        memory = hit.memory
+        if memory.id in seen_ids or (memory.mem0_id and memory.mem0_id in seen_mem0):
+            continue
+        seen_ids.add(memory.id)
+        if memory.mem0_id:
+            seen_mem0.add(memory.mem0_id)
+        merged.append(hit)
+        if len(merged) >= limit:
+            break
+    return merged
+
+
+def _discard_result(task: asyncio.Task) -> None:
+    # A Mem0 call that missed the deadline finishes in the background; only log its failure
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("mem0 search failed after deadline: %r", task.exception())
+
+
+async def hedged_search(db: AsyncSession, user: User, query: str, limit: int = 5, deadline_ms: Optional[float] = None) -> SearchResult:
+    # Mem0 and the local DB search run concurrently. Mem0's ranking wins when it answers within
+    # the deadline, topped up with local hits; otherwise the local hits are returned without waiting.
+    started = time.perf_counter()
+    deadline = (get_settings().search_deadline_ms if deadline_ms is None else deadline_ms) / 1000.0
+
+    mem0_task: Optional[asyncio.Task] = None
+    if mem0_client_singleton.is_configured():
+        mem0_task = asyncio.create_task(_mem0_search(user.whatsapp_user_id, query))
+    local_hits = await _local_search(db, user.id, query, limit)
+
+    outcome = "local"
+    mem0_results: Optional[list[dict]] = None
+    if mem0_task is not None:
+        remaining = deadline - (time.perf_counter() - started)
+        done, _ = await asyncio.wait({mem0_task}, timeout=max(0.0, remaining))
+        if mem0_task in done:
+            try:
+                mem0_results = mem0_task.result()
+            except Exception:
+                logger.exception("mem0 search failed")
+                outcome = "local_mem0_error"
+            else:
+                outcome = "local_mem0_shed" if mem0_results is None else "local_mem0_empty"
+        else:
+            mem0_task.add_done_callback(_discard_result)
+            outcome = "local_mem0_late"
+
+    mem0_hits = await _resolve_mem0(db, user.id, mem0_results) if mem0_results else []
+    if mem0_hits:
+        result = SearchResult(hits=_merge(mem0_hits, local_hits, limit), backend="mem0")
+        outcome = "mem0"
+    else:
+        result = SearchResult(hits=_merge(local_hits, [], limit), backend="local")
+
+    result.elapsed_ms = (time.perf_counter() - started) * 1000.0
+    search_stats.record(outcome, result.elapsed_ms)
+    return result
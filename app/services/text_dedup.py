@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import get_settings
+from ..models import Memory
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_MASK64 = (1 << 64) - 1
+
+
+def _tokens(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def compute_simhash(text: Optional[str], min_tokens: Optional[int] = None) -> Optional[int]:
+    # 64-bit SimHash over word unigrams + bigrams; None for texts too short to fingerprint
+    if not text:
+        return None
+    tokens = _tokens(text)
+    if min_tokens is None:
+        min_tokens = get_settings().text_dedup_min_tokens
+    if not tokens or len(tokens) < min_tokens:
+        return None
+    weights: dict[str, int] = defaultdict(int)
+    for tok in tokens:
+        weights[tok] += 1
+    for a, b in zip(tokens, tokens[1:]):
+        weights[f"{a} {b}"] += 1
+    vector = [0] * 64
+    for feature, weight in weights.items():
+        h = _feature_hash(feature)
+        for bit in range(64):
+            if (h >> bit) & 1:
+                vector[bit] += weight
+            else:
+                vector[bit] -= weight
+    fingerprint = 0
+    for bit, value in enumerate(vector):
+        if value > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def to_signed64(value: int) -> int:
+    # SQL BIGINT is signed; store the fingerprint's bit pattern as-is
+    value &= _MASK64
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned64(value: int) -> int:
+    return value & _MASK64
+
+
+def simhash_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK64).count("1")
+
+
+def _band_layout(max_distance: int) -> list[Tuple[int, int]]:
+    # max_distance + 1 bands: by pigeonhole, two fingerprints within max_distance bits
+    # agree exactly on at least one band, so band buckets never miss a true match
+    bands = max(1, min(16, max_distance + 1))
+    width = 64 // bands
+    layout = []
+    for i in range(bands):
+        start = i * width
+        end = 64 if i == bands - 1 else start + width
+        layout.append((start, (1 << (end - start)) - 1))
+    return layout
+
+
+class _UserIndex:
+    __slots__ = ("buckets", "size")
+
+    def __init__(self) -> None:
+        self.buckets: dict[Tuple[int, int], list[Tuple[int, int]]] = defaultdict(list)
+        self.size = 0
+
+
+class TextFingerprintIndex:
+    def __init__(self, max_distance: int, max_users: int) -> None:
+        self.max_distance = max_distance
+        self.max_users = max_users
+        self._layout = _band_layout(max_distance)
+        self._users: OrderedDict[int, _UserIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _band_keys(self, fingerprint: int) -> list[Tuple[int, int]]:
+        return [(i, (fingerprint >> start) & mask) for i, (start, mask) in enumerate(self._layout)]
+
+    def is_loaded(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._users
+
+    def load(self, user_id: int, rows: Iterable[Tuple[int, int]]) -> None:
+        index = _UserIndex()
+        for memory_id, fingerprint in rows:
+            fingerprint = to_unsigned64(fingerprint)
+            for key in self._band_keys(fingerprint):
+                index.buckets[key].append((memory_id, fingerprint))
+            index.size += 1
+        with self._lock:
+            self._users[user_id] = index
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def add(self, user_id: int, memory_id: int, fingerprint: int) -> None:
+        # Only extends users already loaded; cold users are rebuilt from the DB on next lookup
+        fingerprint = to_unsigned64(fingerprint)
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                return
+            for key in self._band_keys(fingerprint):
+                index.buckets[key].append((memory_id, fingerprint))
+            index.size += 1
+
+    def find(self, user_id: int, fingerprint: int) -> Optional[Tuple[int, int]]:
+        fingerprint = to_unsigned64(fingerprint)
+        best: Optional[Tuple[int, int]] = None
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                return None
+            self._users.move_to_end(user_id)
+            for key in self._band_keys(fingerprint):
+                for memory_id, candidate in index.buckets.get(key, ()):
+                    distance = simhash_distance(fingerprint, candidate)
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (memory_id, distance)
+        return best
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+async def find_near_duplicate(db: AsyncSession, user_id: int, text: Optional[str]) -> Tuple[Optional[int], Optional[Memory]]:
+    # Returns (fingerprint, duplicate memory or None); fingerprint is None when dedup does not apply
+    settings = get_settings()
+    if settings.text_dedup_mode == "off":
+        return None, None
+    fingerprint = compute_simhash(text)
+    if fingerprint is None:
+        return None, None
+    if not text_fingerprint_index.is_loaded(user_id):
+        rows = await db.execute(
+            select(Memory.id, Memory.text_simhash).where(Memory.user_id == user_id, Memory.text_simhash.isnot(None))
+        )
+        text_fingerprint_index.load(user_id, rows.all())
+    match = text_fingerprint_index.find(user_id, fingerprint)
+    if match is None:
+        return fingerprint, None
+    duplicate = await db.get(Memory, match[0])
+    if duplicate is None or duplicate.user_id != user_id:
+        # Row vanished underneath the index (deleted/archived/moved to another shard); rebuild on next lookup
+        text_fingerprint_index.invalidate(user_id)
+        duplicate = None
+    return fingerprint, duplicate
+
+
+text_fingerprint_index = TextFingerprintIndex(
+    max_distance=get_settings().text_dedup_max_distance,
+    max_users=get_settings().text_dedup_index_max_users,
+)
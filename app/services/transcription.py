@@ -1,6 +1,8 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Optional, Tuple
+
+from .audio_cache import decoded_audio_cache, duration_seconds
 
 
 _whisper_model = None
@@ -18,12 +20,20 @@ def _load_model():
     return _whisper_model
 
 
-def transcribe_audio_file(file_path: str) -> Optional[str]:
+def transcribe_audio(file_path: str, sha256_hex: Optional[str] = None) -> Tuple[Optional[str], Optional[int]]:
+    # Returns (transcript, duration in seconds). With a media hash the PCM comes from the
+    # decoded-audio cache (memory-mapped) and ffmpeg only runs on the first transcription
+    samples = decoded_audio_cache.load(sha256_hex, file_path) if sha256_hex else None
+    duration = duration_seconds(samples) if samples is not None else None
     model = _load_model()
     if model is None:
-        return None
+        return None, duration
     try:
-        result = model.transcribe(file_path)
-        return result.get("text") if isinstance(result, dict) else None
+        result = model.transcribe(samples if samples is not None else file_path)
+        return (result.get("text") if isinstance(result, dict) else None), duration
     except Exception:
-        return None 
\ No newline at end of file
+        return None, duration
+
+
+def transcribe_audio_file(file_path: str, sha256_hex: Optional[str] = None) -> Optional[str]:
+    return transcribe_audio(file_path, sha256_hex)[0]
@@ -1,23 +1,267 @@
 from __future__ import annotations
 
+import logging
+import random
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
 
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
 from ..config import get_settings
+from ..database import db_session, shard_router, shards
+from ..models import Interaction, OutboundMessage, User
+from ..utils.rate_limit import KeyedTokenBuckets
+
+logger = logging.getLogger(__name__)
+
+_TWILIO_API_ROOT = "https://api.twilio.com"
+_CLAIM_LEASE_SECONDS = 120
+_BACKOFF_BASE_SECONDS = 2.0
+_BACKOFF_MAX_SECONDS = 300.0
+_SEND_ACQUIRE_TIMEOUT_SECONDS = 5.0
+
+
+def _build_http_client():
+    from twilio.http.http_client import TwilioHttpClient
+
+    class _PooledHttpClient(TwilioHttpClient):
+        def __init__(self, base_url: Optional[str]) -> None:
+            # pool_connections keeps one requests.Session (and its keep-alive pool) for all sends
+            super().__init__(pool_connections=True, timeout=30)
+            self.base_url = base_url.rstrip("/") if base_url else None
 
+        def request(self, method, url, *args, **kwargs):
+            if self.base_url and url.startswith(_TWILIO_API_ROOT):
+                url = self.base_url + url[len(_TWILIO_API_ROOT):]
+            return super().request(method, url, *args, **kwargs)
+
+    return _PooledHttpClient(get_settings().twilio_api_base_url)
+
+
+@lru_cache(maxsize=1)
+def _twilio_client():
+    # Raises on failure, and lru_cache does not keep exceptions: a failed build is retried next call
+    from twilio.rest import Client  # Lazy import to avoid import error at app import time
 
-def send_whatsapp_message(to_phone_e164: str, body: str) -> Optional[str]:
     settings = get_settings()
-    if not settings.twilio_account_sid or not settings.twilio_auth_token or not settings.twilio_whatsapp_number:
+    return Client(settings.twilio_account_sid, settings.twilio_auth_token, http_client=_build_http_client())
+
+
+def get_twilio_client():
+    settings = get_settings()
+    if not settings.twilio_account_sid or not settings.twilio_auth_token:
         return None
     try:
-        from twilio.rest import Client  # Lazy import to avoid import error at app import time
+        return _twilio_client()
+    except Exception:
+        logger.exception("could not build the Twilio client")
+        return None
+
+
+@lru_cache(maxsize=1)
+def _sender_buckets() -> KeyedTokenBuckets:
+    settings = get_settings()
+    return KeyedTokenBuckets(rate=settings.outbound_rate_per_second, capacity=settings.outbound_burst)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    status = getattr(exc, "status", None)
+    if status is None:
+        # Connection errors, timeouts, etc.
+        return True
+    return status == 429 or status >= 500
+
+
+def _backoff_seconds(attempts: int) -> float:
+    delay = min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _create_message(from_phone: str, to_phone_e164: str, body: str) -> str:
+    client = get_twilio_client()
+    if client is None:
+        raise RuntimeError("Twilio is not configured")
+    msg = client.messages.create(from_=from_phone, to=to_phone_e164, body=body)
+    return msg.sid
 
-        client = Client(settings.twilio_account_sid, settings.twilio_auth_token)
-        msg = client.messages.create(
-            from_=settings.twilio_whatsapp_number,
-            to=to_phone_e164,
-            body=body,
+
+def _queue_shard(to_phone_e164: str, user_id: Optional[int]) -> tuple[int, Optional[int]]:
+    if user_id is not None:
+        return shard_router.shard_for_user_id(user_id), user_id
+    for shard in shards:
+        with db_session(shard.index) as db:
+            found = db.query(User.id).filter(User.phone_number == to_phone_e164).first()
+        if found:
+            return shard.index, found[0]
+    return 0, None
+
+
+def send_whatsapp_message(
+    to_phone_e164: str,
+    body: str,
+    user_id: Optional[int] = None,
+    acquire_timeout: float = _SEND_ACQUIRE_TIMEOUT_SECONDS,
+) -> Optional[str]:
+    # Queued like any other outbound message (retries, outbound Interaction), then attempted right away.
+    # Returns the SID when that attempt succeeds; None leaves the row to the sender's retries.
+    settings = get_settings()
+    if not settings.twilio_account_sid or not settings.twilio_auth_token or not settings.twilio_whatsapp_number:
+        return None
+    shard_index, user_id = _queue_shard(to_phone_e164, user_id)
+    with db_session(shard_index) as db:
+        message = enqueue_whatsapp_message(db, to_phone_e164, body, user_id=user_id)
+        db.flush()
+        message_id = message.id
+    outbound_sender_singleton._process(message_id, shard_index, acquire_timeout=acquire_timeout)
+    with db_session(shard_index) as db:
+        message = db.get(OutboundMessage, message_id)
+        return message.twilio_message_sid if message.status == "sent" else None
+
+
+def enqueue_whatsapp_message(db: Session, to_phone_e164: str, body: str, user_id: Optional[int] = None) -> OutboundMessage:
+    # Only adds the row; the caller's commit makes it visible to the sender
+    settings = get_settings()
+    message = OutboundMessage(
+        user_id=user_id,
+        to_phone=to_phone_e164,
+        from_phone=settings.twilio_whatsapp_number or "",
+        body=body,
+        status="queued",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(message)
+    return message
+
+
+class OutboundSender:
+    def __init__(self, batch_size: int = 50) -> None:
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbound-sender", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        interval = get_settings().outbound_poll_interval_seconds
+        while not self._stop.is_set():
+            try:
+                processed = self.drain_once()
+            except Exception:
+                logger.exception("outbound sender iteration failed")
+                processed = 0
+            if not processed:
+                self._stop.wait(interval)
+
+    def drain_once(self) -> int:
+        now = datetime.utcnow()
+        processed = 0
+        # Each shard keeps the queue rows of its own users
+        for shard in shards:
+            with db_session(shard.index) as db:
+                due_ids = [
+                    row_id
+                    for (row_id,) in db.query(OutboundMessage.id)
+                    .filter(
+                        or_(OutboundMessage.status == "queued", OutboundMessage.status == "sending"),
+                        OutboundMessage.next_attempt_at <= now,
+                    )
+                    .order_by(OutboundMessage.id)
+                    .limit(self.batch_size)
+                    .all()
+                ]
+            for message_id in due_ids:
+                if self._stop.is_set():
+                    return processed
+                if self._process(message_id, shard.index):
+                    processed += 1
+        return processed
+
+    def _claim(self, db: Session, message_id: int) -> bool:
+        # Conditional update so several workers/processes never send the same row twice;
+        # a stale `sending` row (crashed worker) becomes claimable again once its lease expires
+        now = datetime.utcnow()
+        result = db.execute(
+            update(OutboundMessage)
+            .where(
+                OutboundMessage.id == message_id,
+                or_(OutboundMessage.status == "queued", OutboundMessage.status == "sending"),
+                OutboundMessage.next_attempt_at <= now,
+            )
+            .values(status="sending", next_attempt_at=now + timedelta(seconds=_CLAIM_LEASE_SECONDS))
         )
-        return msg.sid
-    except Exception:
-        return None 
\ No newline at end of file
+        return result.rowcount == 1
+
+    def _process(self, message_id: int, shard_index: int = 0, acquire_timeout: float = _CLAIM_LEASE_SECONDS / 2) -> bool:
+        settings = get_settings()
+        with db_session(shard_index) as db:
+            if not self._claim(db, message_id):
+                return False
+            message = db.get(OutboundMessage, message_id)
+            to_phone, from_phone, body = message.to_phone, message.from_phone, message.body
+
+        bucket = _sender_buckets().get(from_phone)
+        if not bucket.acquire(timeout=acquire_timeout):
+            with db_session(shard_index) as db:
+                db.execute(
+                    update(OutboundMessage)
+                    .where(OutboundMessage.id == message_id)
+                    .values(status="queued", next_attempt_at=datetime.utcnow())
+                )
+            return False
+
+        sid: Optional[str] = None
+        error: Optional[Exception] = None
+        try:
+            sid = _create_message(from_phone, to_phone, body)
+        except Exception as exc:
+            error = exc
+
+        with db_session(shard_index) as db:
+            message = db.get(OutboundMessage, message_id)
+            message.attempts = (message.attempts or 0) + 1
+            if error is None:
+                message.status = "sent"
+                message.twilio_message_sid = sid
+                message.sent_at = datetime.utcnow()
+                message.last_error = None
+                user_id = message.user_id
+                if user_id is None:
+                    user = db.query(User).filter(User.phone_number == to_phone).first()
+                    user_id = user.id if user else None
+                if user_id is not None:
+                    db.add(
+                        Interaction(
+                            user_id=user_id,
+                            twilio_message_sid=sid,
+                            message_direction="outbound",
+                            message_type="text",
+                            body_text=body,
+                        )
+                    )
+            else:
+                message.last_error = str(error)[:2000]
+                if _is_retryable(error) and message.attempts < settings.outbound_max_attempts:
+                    message.status = "queued"
+                    message.next_attempt_at = datetime.utcnow() + timedelta(seconds=_backoff_seconds(message.attempts))
+                else:
+                    message.status = "failed"
+                    logger.warning("outbound message %s failed permanently: %s", message_id, error)
+        return True
+
+
+outbound_sender_singleton = OutboundSender()
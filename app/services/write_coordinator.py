@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ..config import get_settings
+from ..database import shards
+
+logger = logging.getLogger(__name__)
+
+# A write job adds/flushes rows on the shared batch session and returns its result.
+# Jobs may be re-run against a fresh session if another job in the batch fails, so they
+# must only touch the session (no external side effects).
+WriteJob = Callable[[AsyncSession], Awaitable[Any]]
+
+
+def _resolve(future: asyncio.Future, result: Any = None, exc: Optional[BaseException] = None) -> None:
+    # The submitting request may have been cancelled meanwhile
+    if future.done():
+        return
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(result)
+
+
+class WriteCoordinator:
+    def __init__(self, session_factory: async_sessionmaker, max_batch_size: int, max_wait_ms: float, enabled: bool = True) -> None:
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.enabled = enabled
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.jobs = 0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        return self._queue
+
+    async def submit(self, job: WriteJob) -> Any:
+        if not self.enabled:
+            return await self._run_alone(job)
+        future = asyncio.get_running_loop().create_future()
+        self._ensure_worker().put_nowait((job, future))
+        return await future
+
+    async def close(self) -> None:
+        # Drain what is already queued, then stop the worker
+        if self._worker is None or self._worker.done() or self._loop is not asyncio.get_running_loop():
+            self._worker = None
+            return
+        assert self._queue is not None
+        self._queue.put_nowait(None)
+        await self._worker
+        self._worker = None
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._commit_batch(batch)
+            except Exception as exc:
+                logger.exception("write batch failed")
+                for _, future in batch:
+                    _resolve(future, exc=exc)
+
+    async def _commit_batch(self, batch: list) -> None:
+        pending = [(job, future) for job, future in batch if not future.done()]
+        while pending:
+            results: list = []
+            failed_at: Optional[int] = None
+            async with self.session_factory() as session:
+                for i, (job, _) in enumerate(pending):
+                    try:
+                        results.append(await job(session))
+                        await session.flush()
+                    except Exception as exc:
+                        failed_at = i
+                        failure = exc
+                        break
+                if failed_at is None:
+                    try:
+                        # One transaction (and one fsync) for the whole batch
+                        await session.commit()
+                    except Exception as exc:
+                        await session.rollback()
+                        if len(pending) == 1:
+                            _resolve(pending[0][1], exc=exc)
+                            return
+                        # Unattributable commit failure: fall back to one transaction per job
+                        for job, future in pending:
+                            try:
+                                _resolve(future, await self._run_alone(job))
+                            except Exception as job_exc:
+                                _resolve(future, exc=job_exc)
+                        return
+                    self.batches += 1
+                    self.jobs += len(pending)
+                    for (_, future), result in zip(pending, results):
+                        _resolve(future, result)
+                    return
+                await session.rollback()
+            # The failing job gets its own error; the rest of the batch is replayed without it
+            _resolve(pending[failed_at][1], exc=failure)
+            pending = pending[:failed_at] + pending[failed_at + 1:]
+
+    async def _run_alone(self, job: WriteJob) -> Any:
+        async with self.session_factory() as session:
+            try:
+                result = await job(session)
+                await session.commit()
+                return result
+            except Exception:
+                await session.rollback()
+                raise
+
+
+# One coordinator per shard: batches never span databases, and shards commit in parallel
+write_coordinators = [
+    WriteCoordinator(
+        shard.async_session_factory,
+        max_batch_size=get_settings().write_batch_max_size,
+        max_wait_ms=get_settings().write_batch_max_wait_ms,
+        enabled=get_settings().write_coordinator_enabled,
+    )
+    for shard in shards
+]
+write_coordinator_singleton = write_coordinators[0]
+
+
+def write_coordinator_for(shard_index: int) -> WriteCoordinator:
+    return write_coordinators[shard_index]
+
+
+async def close_write_coordinators() -> None:
+    for coordinator in write_coordinators:
+        await coordinator.close()
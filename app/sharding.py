@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+# User ids are globally unique across shards: shard N allocates ids from [N * STRIDE, (N + 1) * STRIDE)
+SHARD_ID_STRIDE = 1 << 40
+
+
+class ShardRouter:
+    def __init__(self, num_shards: int, directory_path: str) -> None:
+        self.num_shards = num_shards
+        self.directory_path = directory_path
+        self._directory: dict = {"users": {}, "ids": {}}
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        # The rebalancing tool rewrites the file; workers pick changes up on the next lookup
+        try:
+            mtime = os.stat(self.directory_path).st_mtime
+        except FileNotFoundError:
+            return self._directory
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.directory_path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    self._directory = {"users": data.get("users", {}), "ids": data.get("ids", {})}
+                    self._mtime = mtime
+        return self._directory
+
+    def hashed_shard(self, whatsapp_user_id: str) -> int:
+        digest = hashlib.blake2b((whatsapp_user_id or "").encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % self.num_shards
+
+    def shard_for_whatsapp_id(self, whatsapp_user_id: str) -> int:
+        if self.num_shards == 1:
+            return 0
+        pinned = self._load()["users"].get(whatsapp_user_id)
+        if pinned is not None and pinned < self.num_shards:
+            return pinned
+        return self.hashed_shard(whatsapp_user_id)
+
+    def shard_for_user_id(self, user_id: int) -> int:
+        if self.num_shards == 1:
+            return 0
+        pinned = self._load()["ids"].get(str(user_id))
+        if pinned is not None and pinned < self.num_shards:
+            return pinned
+        index = user_id // SHARD_ID_STRIDE
+        return index if index < self.num_shards else 0
+
+    def pin(self, users: dict[str, int], ids: dict[int, int]) -> None:
+        directory = self._load()
+        merged = {
+            "users": {**directory["users"], **users},
+            "ids": {**directory["ids"], **{str(k): v for k, v in ids.items()}},
+        }
+        os.makedirs(os.path.dirname(self.directory_path) or ".", exist_ok=True)
+        tmp_path = f"{self.directory_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(merged, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.directory_path)
+        with self._lock:
+            self._directory = merged
+            self._mtime = os.stat(self.directory_path).st_mtime
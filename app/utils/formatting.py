@@ -0,0 +1,15 @@
+from __future__ import annotations
+
+
+def format_memory_line(memory) -> str:
+    when = memory.created_at.isoformat(timespec="seconds") if memory.created_at else ""
+    snippet = (memory.text or "").strip()
+    if len(snippet) > 120:
+        snippet = snippet[:117] + "..."
+    return f"- [{when}] ({memory.memory_type}) {snippet}"
+
+
+def format_memories_reply(lines: list[str]) -> str:
+    if not lines:
+        return "No memories found."
+    return "Here are your memories:\n" + "\n".join(lines[:10])
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def time_until_available(self, tokens: float = 1.0) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = tokens - self._tokens
+            if missing <= 0:
+                return 0.0
+            if self.rate <= 0:
+                return float("inf")
+            return missing / self.rate
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire(tokens):
+                return True
+            wait = self.time_until_available(tokens)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+# One bucket per key (sender number, user id, ...), LRU-bounded to `max_keys`
+class KeyedTokenBuckets:
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def try_acquire(self, key: str, tokens: float = 1.0) -> bool:
+        return self.get(key).try_acquire(tokens)
+
+    def acquire(self, key: str, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        return self.get(key).acquire(tokens, timeout=timeout)
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+# Moves interactions (with their memories and media rows) older than ARCHIVE_HORIZON_DAYS
+# into compressed per-user, per-month archive segments under STORAGE_DIR/archive.
+#
+#   python scripts/archive_interactions.py [--horizon-days 180] [--batch-size 500] [--dry-run]
+
+import argparse
+import json
+
+from app.database import create_all_shards
+from app.services.archive import archive_old_rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--horizon-days", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    # Creates archive_segments on databases that predate archival
+    create_all_shards()
+    stats = archive_old_rows(horizon_days=args.horizon_days, batch_size=args.batch_size, dry_run=args.dry_run)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+# Computes `memories.text_simhash` for rows created before near-duplicate detection existed.
+#
+#   python scripts/backfill_text_fingerprints.py [--batch-size 1000]
+
+import argparse
+
+from sqlalchemy import inspect, select, text, update
+
+from app.database import db_session, shards
+from app.models import Memory
+from app.services.text_dedup import compute_simhash, to_signed64
+
+
+def ensure_column(engine) -> None:
+    # `create_all` does not alter existing tables
+    columns = {c["name"] for c in inspect(engine).get_columns("memories")}
+    if "text_simhash" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE memories ADD COLUMN text_simhash BIGINT"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    for shard in shards:
+        ensure_column(shard.engine)
+        last_id = 0
+        fingerprinted = 0
+        while True:
+            with db_session(shard.index) as db:
+                rows = db.execute(
+                    select(Memory.id, Memory.text)
+                    .where(Memory.id > last_id, Memory.text_simhash.is_(None), Memory.text.isnot(None))
+                    .order_by(Memory.id)
+                    .limit(args.batch_size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                updates = []
+                for row in rows:
+                    fingerprint = compute_simhash(row.text)
+                    if fingerprint is not None:
+                        updates.append({"id": row.id, "text_simhash": to_signed64(fingerprint)})
+                if updates:
+                    db.execute(update(Memory), updates)
+                fingerprinted += len(updates)
+            print(f"shard {shard.index}: fingerprinted {fingerprinted} memories (last id {last_id})")
+
+if __name__ == "__main__":
+    main()
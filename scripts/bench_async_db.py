@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+# Per-worker concurrency: the old handlers (sync Session inside `async def`) vs AsyncSession.
+#
+#   python scripts/bench_async_db.py --rows 200000 --requests 400 --concurrency 32
+#
+# Runs against a throwaway SQLite database unless DATABASE_URL is already set.
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    _tmp = tempfile.mkdtemp(prefix="bench-async-db-")
+    os.environ["STORAGE_DIR"] = _tmp
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'app.db')}"
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from app.database import AsyncSessionLocal, Base, SessionLocal, async_engine, db_session, engine  # noqa: E402
+from app.models import Interaction, User  # noqa: E402
+
+
+def seed(rows: int) -> int:
+    Base.metadata.create_all(bind=engine)
+    with db_session() as db:
+        user = User(whatsapp_user_id="bench-waid", phone_number="whatsapp:+10000000000")
+        db.add(user)
+        db.flush()
+        existing = db.scalar(select(func.count(Interaction.id)).where(Interaction.user_id == user.id)) or 0
+        batch = [
+            {"user_id": user.id, "message_direction": "inbound", "message_type": "text", "body_text": f"message {i}"}
+            for i in range(existing, rows)
+        ]
+        if batch:
+            db.execute(insert(Interaction), batch)
+        return user.id
+
+
+def _query(user_id: int):
+    # Same shape as /analytics/summary + /interactions/recent
+    return (
+        select(func.count(Interaction.id)).where(Interaction.user_id == user_id),
+        select(Interaction).where(Interaction.user_id == user_id).order_by(Interaction.occurred_at.desc()).limit(10),
+    )
+
+
+async def legacy_handler(user_id: int) -> None:
+    count_q, recent_q = _query(user_id)
+    db = SessionLocal()
+    try:
+        db.scalar(count_q)
+        db.execute(recent_q).scalars().all()
+    finally:
+        db.close()
+
+
+async def async_handler(user_id: int) -> None:
+    count_q, recent_q = _query(user_id)
+    async with AsyncSessionLocal() as db:
+        await db.scalar(count_q)
+        (await db.execute(recent_q)).scalars().all()
+
+
+async def _loop_lag_probe(stop: asyncio.Event, samples: list[float], interval: float = 0.005) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run(handler, user_id: int, requests: int, concurrency: int) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    lag: list[float] = []
+    stop = asyncio.Event()
+
+    async def one() -> None:
+        async with sem:
+            await handler(user_id)
+        # Measured from the burst's arrival: includes time queued behind other requests on this worker
+        latencies.append(time.perf_counter() - started)
+
+    probe = asyncio.create_task(_loop_lag_probe(stop, lag))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "max_loop_lag_ms": (max(lag) if lag else 0.0) * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    user_id = seed(args.rows)
+    # Warm both pools before measuring
+    await legacy_handler(user_id)
+    await async_handler(user_id)
+
+    for name, handler in (("sync Session (before)", legacy_handler), ("AsyncSession (after)", async_handler)):
+        stats = await run(handler, user_id, args.requests, args.concurrency)
+        print(
+            f"{name:24s} {stats['rps']:8.1f} req/s  p50 {stats['p50_ms']:7.2f} ms  "
+            f"p99 {stats['p99_ms']:7.2f} ms  max loop lag {stats['max_loop_lag_ms']:7.2f} ms"
+        )
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
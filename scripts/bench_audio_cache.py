@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+# Reprocessing time of an audio corpus with and without the decoded-audio cache.
+#
+#   python scripts/bench_audio_cache.py --files 50 --seconds 30          # synthetic Opus voice notes
+#   python scripts/bench_audio_cache.py --corpus data/media [--transcribe]
+#
+# Pass 1 decodes every file with ffmpeg and fills the cache; pass 2 is a reprocessing run
+# that reads the memory-mapped PCM instead. `--transcribe` includes Whisper in both passes.
+
+import argparse
+import glob
+import hashlib
+import os
+import subprocess
+import tempfile
+import time
+
+from app.services.audio_cache import DecodedAudioCache, decode_audio, duration_seconds
+from app.services.transcription import _load_model
+
+
+def make_corpus(directory: str, files: int, seconds: int) -> list[str]:
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, f"note{i}.ogg")
+        subprocess.run(
+            [
+                "ffmpeg", "-nostdin", "-loglevel", "error", "-y",
+                "-f", "lavfi", "-i", f"sine=frequency={220 + 10 * i}:duration={seconds}",
+                "-f", "lavfi", "-i", f"anoisesrc=duration={seconds}:amplitude=0.05",
+                "-filter_complex", "amix=inputs=2", "-ac", "1", "-ar", "48000", "-c:a", "libopus", "-b:a", "24k", path,
+            ],
+            check=True,
+        )
+        paths.append(path)
+    return paths
+
+
+def sha256_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def run_pass(cache: DecodedAudioCache, corpus: list[tuple[str, str]], model) -> tuple[float, int]:
+    started = time.perf_counter()
+    total_seconds = 0
+    for path, sha in corpus:
+        samples = cache.load(sha, path)
+        if samples is None:
+            raise SystemExit(f"could not decode {path} (is ffmpeg on PATH?)")
+        total_seconds += duration_seconds(samples)
+        if model is not None:
+            model.transcribe(samples)
+        else:
+            # Touch every sample so mapped pages are actually read
+            float(samples.sum())
+    return time.perf_counter() - started, total_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="directory of audio files (default: generate synthetic notes)")
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--transcribe", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-audio-cache-")
+    if args.corpus:
+        paths = sorted(p for p in glob.glob(os.path.join(args.corpus, "*")) if p.endswith((".ogg", ".mp3", ".mp4", ".wav", ".m4a")))
+    else:
+        paths = make_corpus(workdir, args.files, args.seconds)
+    corpus = [(path, sha256_file(path)) for path in paths]
+
+    model = None
+    if args.transcribe:
+        model = _load_model()
+        if model is None:
+            raise SystemExit("--transcribe needs openai-whisper installed")
+
+    cache = DecodedAudioCache(os.path.join(workdir, "audio_cache"), max_bytes=1 << 40)
+    started = time.perf_counter()
+    for path, _ in corpus:
+        decode_audio(path)
+    uncached = time.perf_counter() - started
+    cold, audio_seconds = run_pass(cache, corpus, model)
+    warm, _ = run_pass(cache, corpus, model)
+
+    print(f"corpus: {len(corpus)} files, {audio_seconds} s of audio")
+    print(f"ffmpeg decode only      {uncached:8.2f} s")
+    print(f"pass 1 (decode + fill)  {cold:8.2f} s")
+    print(f"pass 2 (cached PCM)     {warm:8.2f} s   x{cold / warm if warm else float('inf'):.1f} faster")
+    print(cache.stats())
+
+
+if __name__ == "__main__":
+    main()
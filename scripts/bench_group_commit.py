@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+# Webhook write throughput with and without the group-commit write coordinator.
+#
+#   python scripts/bench_group_commit.py --messages 2000 --concurrency 64
+#
+# Runs against a throwaway SQLite database unless DATABASE_URL is already set.
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    _tmp = tempfile.mkdtemp(prefix="bench-group-commit-")
+    os.environ["STORAGE_DIR"] = _tmp
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'app.db')}"
+
+from app.config import get_settings  # noqa: E402
+from app.database import AsyncSessionLocal, Base, async_engine, db_session, engine  # noqa: E402
+from app.models import User  # noqa: E402
+from app.routers.webhook import _message_writer  # noqa: E402
+from app.services.write_coordinator import WriteCoordinator  # noqa: E402
+
+
+def seed() -> int:
+    Base.metadata.create_all(bind=engine)
+    with db_session() as db:
+        user = User(whatsapp_user_id="bench-waid", phone_number="whatsapp:+10000000000")
+        db.add(user)
+        db.flush()
+        return user.id
+
+
+async def run(coordinator: WriteCoordinator, user_id: int, prefix: str, messages: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with sem:
+            # Same inserts as an ingested text message: Interaction + Memory
+            await coordinator.submit(
+                _message_writer(
+                    user_id,
+                    f"{prefix}-{i}",
+                    "text",
+                    f"bench message {i}",
+                    memory_fields={"memory_type": "text", "text": f"bench message {i}"},
+                )
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(messages)))
+    elapsed = time.perf_counter() - started
+    await coordinator.close()
+    return messages / elapsed
+
+
+async def main() -> None:
+    settings = get_settings()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=settings.write_batch_max_size)
+    parser.add_argument("--wait-ms", type=float, default=settings.write_batch_max_wait_ms)
+    args = parser.parse_args()
+
+    user_id = seed()
+    for name, enabled in (("one commit per message", False), ("group commit", True)):
+        coordinator = WriteCoordinator(AsyncSessionLocal, args.batch_size, args.wait_ms, enabled=enabled)
+        rate = await run(coordinator, user_id, f"{'grp' if enabled else 'solo'}-{time.time_ns()}", args.messages, args.concurrency)
+        detail = f" ({coordinator.batches} batches)" if enabled else ""
+        print(f"{name:24s} {rate:8.1f} msg/s{detail}")
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
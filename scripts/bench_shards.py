@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+# Webhook write throughput with users spread over 1, 2, 4, ... shards.
+#
+#   python scripts/bench_shards.py --shards 1 2 4 --messages 4000 --processes 4
+#
+# Each process plays one web worker (own engines, one write coordinator per shard) and
+# every shard is a throwaway SQLite file; with one shard all workers queue on a single
+# write lock, with N shards they commit to N databases in parallel.
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+
+_tmp = tempfile.mkdtemp(prefix="bench-shards-")
+os.environ.setdefault("STORAGE_DIR", _tmp)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'app.db')}")
+
+from app.config import get_settings  # noqa: E402
+from app.database import Base, _build_shard  # noqa: E402
+from app.models import User  # noqa: E402
+from app.routers.webhook import _message_writer  # noqa: E402
+from app.services.write_coordinator import WriteCoordinator  # noqa: E402
+from app.sharding import ShardRouter  # noqa: E402
+
+
+def setup(num_shards: int, users: int) -> tuple[list[str], list[tuple[int, int]]]:
+    run_dir = tempfile.mkdtemp(prefix=f"{num_shards}-", dir=_tmp)
+    urls = [f"sqlite:///{os.path.join(run_dir, f'shard{i}.db')}" for i in range(num_shards)]
+    shard_list = [_build_shard(i, url) for i, url in enumerate(urls)]
+    router = ShardRouter(num_shards, os.path.join(run_dir, "shard_directory.json"))
+    for shard in shard_list:
+        Base.metadata.create_all(bind=shard.engine)
+    user_ids: list[tuple[int, int]] = []
+    for n in range(users):
+        waid = f"bench-{n}"
+        shard = shard_list[router.shard_for_whatsapp_id(waid)]
+        with shard.session_factory() as db:
+            user = User(whatsapp_user_id=waid, phone_number=f"whatsapp:+1{n:010d}")
+            db.add(user)
+            db.commit()
+            user_ids.append((shard.index, user.id))
+    for shard in shard_list:
+        shard.engine.dispose()
+    return urls, user_ids
+
+
+async def _worker(urls: list[str], user_ids: list[tuple[int, int]], worker: int, messages: range, concurrency: int, group_commit: bool) -> int:
+    # One web worker: its own engines and one write coordinator per shard
+    settings = get_settings()
+    shard_list = [_build_shard(i, url) for i, url in enumerate(urls)]
+    coordinators = [
+        WriteCoordinator(shard.async_session_factory, settings.write_batch_max_size, settings.write_batch_max_wait_ms, enabled=group_commit)
+        for shard in shard_list
+    ]
+    sem = asyncio.Semaphore(concurrency)
+    failed = 0
+
+    async def one(i: int) -> None:
+        nonlocal failed
+        shard_index, user_id = user_ids[i % len(user_ids)]
+        async with sem:
+            try:
+                await coordinators[shard_index].submit(
+                    _message_writer(user_id, f"s{len(urls)}-{i}", "text", f"bench message {i}", memory_fields={"memory_type": "text", "text": f"bench message {i}"})
+                )
+            except OperationalError:
+                # "database is locked": the writer waited out SQLite's busy timeout
+                failed += 1
+
+    await asyncio.gather(*(one(i) for i in messages))
+    for coordinator in coordinators:
+        await coordinator.close()
+    for shard in shard_list:
+        await shard.async_engine.dispose()
+    return failed
+
+
+def _worker_main(args: tuple) -> int:
+    return asyncio.run(_worker(*args))
+
+
+def run(num_shards: int, messages: int, users: int, processes: int, concurrency: int, group_commit: bool) -> tuple[float, int]:
+    urls, user_ids = setup(num_shards, users)
+    jobs = [(urls, user_ids, w, range(w, messages, processes), concurrency, group_commit) for w in range(processes)]
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes) as pool:
+        started = time.perf_counter()
+        failed = sum(pool.map(_worker_main, jobs))
+        elapsed = time.perf_counter() - started
+    return (messages - failed) / elapsed, failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--messages", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--no-group-commit", action="store_true")
+    args = parser.parse_args()
+
+    baseline = None
+    for num_shards in args.shards:
+        rate, failed = run(num_shards, args.messages, args.users, args.processes, args.concurrency, not args.no_group_commit)
+        baseline = baseline or rate
+        print(f"{num_shards:2d} shard(s) {rate:8.1f} msg/s  x{rate / baseline:.2f}  ({failed} lock timeouts)")
+
+
+if __name__ == "__main__":
+    main()
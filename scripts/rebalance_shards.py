@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+# Inspects and rebalances users across DATABASE_SHARD_URLS.
+#
+#   python scripts/rebalance_shards.py status
+#   python scripts/rebalance_shards.py pin                      # before adding shards: keep existing users where they are
+#   python scripts/rebalance_shards.py move --user-id 42 --to 1 [--dry-run] [--settle-seconds 60]
+#   python scripts/rebalance_shards.py spread [--max-users 100] [--dry-run] [--settle-seconds 60]   # move pinned users to their hashed shard
+#
+# A move copies the user's rows to the target shard, switches the shard directory, waits for
+# requests that were routed to the source before the switch, copies whatever arrived meanwhile,
+# then deletes the copied source rows. User ids are kept; interaction/memory/media ids are
+# re-assigned by the target shard.
+
+import argparse
+import json
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, or_, select, update
+
+from app.database import create_all_shards, db_session, shard_router, shards
+from app.models import ArchiveSegment, IdAllocator, Interaction, MediaAsset, Memory, OutboundMessage, User
+from app.services.twilio_messaging import _CLAIM_LEASE_SECONDS
+from app.sharding import SHARD_ID_STRIDE
+
+# Longer than any webhook request (media download, transcription, Mem0 retries) plus a write batch
+DEFAULT_SETTLE_SECONDS = 60.0
+_TERMINAL_OUTBOUND = ("sent", "failed")
+
+
+def _row_dict(obj, exclude: tuple[str, ...] = ("id",)) -> dict:
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns if c.key not in exclude}
+
+
+def find_user_shard(user_id: int) -> Optional[int]:
+    for shard in shards:
+        with db_session(shard.index) as db:
+            if db.get(User, user_id) is not None:
+                return shard.index
+    return None
+
+
+def status() -> None:
+    for shard in shards:
+        with db_session(shard.index) as db:
+            print(json.dumps({
+                "shard": shard.index,
+                "users": db.scalar(select(func.count(User.id))) or 0,
+                "interactions": db.scalar(select(func.count(Interaction.id))) or 0,
+                "memories": db.scalar(select(func.count(Memory.id))) or 0,
+            }))
+
+
+def pin() -> None:
+    users: dict[str, int] = {}
+    ids: dict[int, int] = {}
+    for shard in shards:
+        with db_session(shard.index) as db:
+            for user_id, whatsapp_user_id in db.execute(select(User.id, User.whatsapp_user_id)).all():
+                users[whatsapp_user_id] = shard.index
+                ids[user_id] = shard.index
+    shard_router.pin(users, ids)
+    print(f"pinned {len(ids)} users in {shard_router.directory_path}")
+
+
+def _media_collisions(user_id: int, source: int, target: int) -> list[str]:
+    # sha256 is unique per shard: the target may already hold the same file for another user
+    with db_session(source) as src:
+        hashes = list(src.execute(
+            select(MediaAsset.sha256_hash)
+            .join(Interaction, MediaAsset.interaction_id == Interaction.id)
+            .where(Interaction.user_id == user_id)
+        ).scalars())
+    if not hashes:
+        return []
+    with db_session(target) as dst:
+        return list(dst.execute(select(MediaAsset.sha256_hash).where(MediaAsset.sha256_hash.in_(hashes))).scalars())
+
+
+def _copy_rows(user_id: int, source: int, target: int, state: dict) -> dict:
+    # Copies rows newer than the previous pass; `state` carries id maps and high-water marks.
+    # Outbound rows still waiting to be sent are left to `_move_pending_outbound`.
+    counts = {"interactions": 0, "memories": 0, "media_assets": 0, "outbound_messages": 0}
+    with db_session(source) as src, db_session(target) as dst:
+        if dst.get(User, user_id) is None:
+            user = src.get(User, user_id)
+            dst.add(User(id=user.id, **_row_dict(user)))
+            dst.flush()
+
+        interactions = list(src.execute(
+            select(Interaction).where(Interaction.user_id == user_id, Interaction.id > state["interaction_id"]).order_by(Interaction.id)
+        ).scalars())
+        for interaction in interactions:
+            copy = Interaction(**_row_dict(interaction))
+            dst.add(copy)
+            dst.flush()
+            state["interaction_map"][interaction.id] = copy.id
+            counts["interactions"] += 1
+            for asset in src.execute(select(MediaAsset).where(MediaAsset.interaction_id == interaction.id)).scalars():
+                if dst.execute(select(MediaAsset.id).where(MediaAsset.sha256_hash == asset.sha256_hash)).first():
+                    # Checked before the move started; only media that arrived meanwhile can get here
+                    raise SystemExit(
+                        f"media {asset.id} of user {user_id} has sha256 {asset.sha256_hash} already stored on shard {target}; "
+                        f"move incomplete, the user's rows are on both shards"
+                    )
+                dst.add(MediaAsset(**{**_row_dict(asset), "interaction_id": copy.id}))
+                counts["media_assets"] += 1
+        if interactions:
+            state["interaction_id"] = interactions[-1].id
+
+        memories = list(src.execute(
+            select(Memory).where(Memory.user_id == user_id, Memory.id > state["memory_id"]).order_by(Memory.id)
+        ).scalars())
+        for memory in memories:
+            interaction_id = state["interaction_map"].get(memory.interaction_id) if memory.interaction_id else None
+            dst.add(Memory(**{**_row_dict(memory), "interaction_id": interaction_id}))
+            counts["memories"] += 1
+        if memories:
+            state["memory_id"] = memories[-1].id
+
+        # The source's sender may still deliver queued/sending rows; copying those would send them twice
+        outbound = src.execute(
+            select(OutboundMessage).where(OutboundMessage.user_id == user_id, OutboundMessage.status.in_(_TERMINAL_OUTBOUND))
+        ).scalars()
+        for message in outbound:
+            if message.id in state["outbound_ids"]:
+                continue
+            dst.add(OutboundMessage(**_row_dict(message)))
+            state["outbound_ids"].add(message.id)
+            counts["outbound_messages"] += 1
+
+        # Segment files stay where they are; only their index rows move
+        for segment in src.execute(select(ArchiveSegment).where(ArchiveSegment.user_id == user_id)).scalars():
+            existing = dst.execute(
+                select(ArchiveSegment).where(ArchiveSegment.user_id == user_id, ArchiveSegment.month == segment.month)
+            ).scalars().first()
+            if existing is None:
+                dst.add(ArchiveSegment(**_row_dict(segment)))
+            else:
+                for key, value in _row_dict(segment).items():
+                    setattr(existing, key, value)
+    return counts
+
+
+def _reserve_source_id(db, user_id: int, source: int) -> None:
+    # The source's high-water mark must cover the departing id, or it could be issued again there
+    low = source * SHARD_ID_STRIDE
+    if not low <= user_id < low + SHARD_ID_STRIDE:
+        return
+    allocator = db.get(IdAllocator, "users")
+    if allocator is None:
+        current = db.scalar(select(func.max(User.id)).where(User.id >= low, User.id < low + SHARD_ID_STRIDE))
+        db.add(IdAllocator(name="users", last_id=max(current or 0, user_id)))
+    elif allocator.last_id < user_id:
+        allocator.last_id = user_id
+
+
+def _move_pending_outbound(user_id: int, source: int, target: int, state: dict) -> int:
+    # Claims unsent rows on the source (status `moving`, which its sender ignores) and commits that
+    # before copying them, so each message is delivered by exactly one shard. A row another sender
+    # holds a live lease on is waited for: it ends up sent (copied as terminal) or claimable.
+    deadline = time.monotonic() + _CLAIM_LEASE_SECONDS + 5
+    while True:
+        with db_session(source) as src:
+            src.execute(
+                update(OutboundMessage)
+                .where(
+                    OutboundMessage.user_id == user_id,
+                    or_(
+                        OutboundMessage.status == "queued",
+                        and_(OutboundMessage.status == "sending", OutboundMessage.next_attempt_at <= datetime.utcnow()),
+                    ),
+                )
+                .values(status="moving")
+            )
+            in_flight = src.scalar(
+                select(func.count(OutboundMessage.id)).where(OutboundMessage.user_id == user_id, OutboundMessage.status == "sending")
+            )
+        if not in_flight or time.monotonic() > deadline:
+            break
+        time.sleep(1.0)
+
+    moved = 0
+    with db_session(source) as src, db_session(target) as dst:
+        for message in src.execute(
+            select(OutboundMessage).where(OutboundMessage.user_id == user_id, OutboundMessage.status == "moving")
+        ).scalars():
+            if message.id in state["outbound_ids"]:
+                continue
+            dst.add(OutboundMessage(**{**_row_dict(message), "status": "queued"}))
+            state["outbound_ids"].add(message.id)
+            moved += 1
+    return moved
+
+
+def _delete_source(user_id: int, source: int, state: dict) -> bool:
+    # Deletes only rows already copied to the target. Returns False, keeping the user, when a late
+    # write is still on the source; the caller copies it over and tries again.
+    with db_session(source) as db:
+        copied_interactions = select(Interaction.id).where(Interaction.user_id == user_id, Interaction.id <= state["interaction_id"])
+        db.execute(delete(MediaAsset).where(MediaAsset.interaction_id.in_(copied_interactions)))
+        db.execute(delete(Memory).where(Memory.user_id == user_id, Memory.id <= state["memory_id"]))
+        db.execute(delete(Interaction).where(Interaction.user_id == user_id, Interaction.id <= state["interaction_id"]))
+        if state["outbound_ids"]:
+            db.execute(delete(OutboundMessage).where(OutboundMessage.id.in_(state["outbound_ids"])))
+        for model in (Interaction, Memory, OutboundMessage):
+            if db.execute(select(model.id).where(model.user_id == user_id).limit(1)).first():
+                return False
+        _reserve_source_id(db, user_id, source)
+        db.execute(delete(ArchiveSegment).where(ArchiveSegment.user_id == user_id))
+        db.execute(delete(User).where(User.id == user_id))
+    return True
+
+
+def move_user(user_id: int, target: int, dry_run: bool = False, settle_seconds: float = DEFAULT_SETTLE_SECONDS) -> dict:
+    source = find_user_shard(user_id)
+    if source is None:
+        raise SystemExit(f"user {user_id} not found on any shard")
+    result = {"user_id": user_id, "from": source, "to": target}
+    if source == target:
+        return {**result, "moved": False}
+    with db_session(source) as db:
+        whatsapp_user_id = db.get(User, user_id).whatsapp_user_id
+    collisions = _media_collisions(user_id, source, target)
+    if collisions:
+        raise SystemExit(f"user {user_id} has media already stored on shard {target} (sha256 {', '.join(collisions)}); not moved")
+    if dry_run:
+        return {**result, "moved": False, "dry_run": True}
+
+    state = {"interaction_id": 0, "memory_id": 0, "outbound_ids": set(), "interaction_map": {}}
+    first = _copy_rows(user_id, source, target, state)
+    # From here on new requests for the user are routed to the target shard; requests that
+    # picked the source before the switch (e.g. waiting in a write batch) get time to land
+    shard_router.pin({whatsapp_user_id: target}, {user_id: target})
+    time.sleep(settle_seconds)
+    delta = _copy_rows(user_id, source, target, state)
+    delta["outbound_messages"] += _move_pending_outbound(user_id, source, target, state)
+    passes = 1
+    while not _delete_source(user_id, source, state):
+        late = _copy_rows(user_id, source, target, state)
+        late["outbound_messages"] += _move_pending_outbound(user_id, source, target, state)
+        delta = {key: delta[key] + late[key] for key in delta}
+        passes += 1
+    return {**result, "moved": True, "copied": first, "delta": delta, "delete_passes": passes}
+
+
+def spread(max_users: int, dry_run: bool, settle_seconds: float = DEFAULT_SETTLE_SECONDS) -> None:
+    # Users pinned away from their hashed shard (e.g. by `pin` before shards were added) move home
+    moved = 0
+    for shard in shards:
+        with db_session(shard.index) as db:
+            rows = db.execute(select(User.id, User.whatsapp_user_id)).all()
+        for user_id, whatsapp_user_id in rows:
+            if moved >= max_users:
+                return
+            target = shard_router.hashed_shard(whatsapp_user_id)
+            if target == shard.index:
+                continue
+            print(json.dumps(move_user(user_id, target, dry_run=dry_run, settle_seconds=settle_seconds), default=str))
+            moved += 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status")
+    sub.add_parser("pin")
+    move = sub.add_parser("move")
+    move.add_argument("--user-id", type=int, required=True)
+    move.add_argument("--to", type=int, required=True)
+    move.add_argument("--dry-run", action="store_true")
+    move.add_argument("--settle-seconds", type=float, default=DEFAULT_SETTLE_SECONDS)
+    spread_cmd = sub.add_parser("spread")
+    spread_cmd.add_argument("--max-users", type=int, default=100)
+    spread_cmd.add_argument("--dry-run", action="store_true")
+    spread_cmd.add_argument("--settle-seconds", type=float, default=DEFAULT_SETTLE_SECONDS)
+    args = parser.parse_args()
+
+    create_all_shards()
+    if args.command == "status":
+        status()
+    elif args.command == "pin":
+        pin()
+    elif args.command == "move":
+        if not 0 <= args.to < len(shards):
+            raise SystemExit(f"--to must be between 0 and {len(shards) - 1}")
+        print(json.dumps(move_user(args.user_id, args.to, dry_run=args.dry_run, settle_seconds=args.settle_seconds), default=str))
+    elif args.command == "spread":
+        spread(args.max_users, args.dry_run, args.settle_seconds)
+
+
+if __name__ == "__main__":
+    main()
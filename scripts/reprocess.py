@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+# Repairs degraded rows in bulk. Resumes from STORAGE_DIR/reprocess/<task>.json unless --restart.
+#
+#   python scripts/reprocess.py --list
+#   python scripts/reprocess.py mem0 --dry-run
+#   python scripts/reprocess.py transcripts --workers 2 --batch-size 50
+#   python scripts/reprocess.py mem0 --rate 5 --restart
+
+import argparse
+import json
+import sys
+
+from app.database import create_all_shards
+from app.services.reprocess import TASKS, run_task
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("task", nargs="?", choices=sorted(TASKS))
+    parser.add_argument("--list", action="store_true", help="show the available tasks")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=5.0, help="external calls per second across all workers")
+    parser.add_argument("--dry-run", action="store_true", help="only count matching rows")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint (retries rows that failed before)")
+    args = parser.parse_args()
+
+    if args.list or not args.task:
+        for task in TASKS.values():
+            print(f"{task.name:16s} {task.description}")
+        return
+
+    if TASKS[args.task].external and not args.dry_run:
+        from app.services.mem0_client import mem0_client_singleton
+
+        if not mem0_client_singleton.is_configured():
+            raise SystemExit("Mem0 is not configured (MEM0_API_KEY / mem0 SDK)")
+
+    create_all_shards()
+
+    def progress(stats: dict) -> None:
+        print(
+            f"[{stats['task']}] shard {stats['shard']} last id {stats['last_id']}: "
+            f"{stats['processed']} processed, {stats['updated']} updated, {stats['failed']} failed "
+            f"({stats['rows_per_second']:.1f} rows/s)",
+            file=sys.stderr,
+        )
+
+    stats = run_task(
+        args.task,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        rate_per_second=args.rate,
+        dry_run=args.dry_run,
+        restart=args.restart,
+        progress=progress,
+    )
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -46,7 +46,49 @@ CREATE TABLE IF NOT EXISTS memories (
     title VARCHAR(255),
     text TEXT,
     labels_json TEXT,
+    text_simhash BIGINT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 CREATE INDEX IF NOT EXISTS idx_memories_user ON memories(user_id);
-CREATE INDEX IF NOT EXISTS idx_memories_created ON memories(created_at); 
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_memories_created ON memories(created_at); 
+
+-- Outbound WhatsApp send queue
+CREATE TABLE IF NOT EXISTS outbound_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    to_phone VARCHAR(32) NOT NULL,
+    from_phone VARCHAR(32) NOT NULL,
+    body TEXT NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    twilio_message_sid VARCHAR(64),
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_outbound_status ON outbound_messages(status);
+CREATE INDEX IF NOT EXISTS idx_outbound_next_attempt ON outbound_messages(next_attempt_at);
+
+
+-- Index of compressed archive segments (one per user and month)
+CREATE TABLE IF NOT EXISTS archive_segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    month VARCHAR(7) NOT NULL,
+    path TEXT NOT NULL,
+    interaction_count INTEGER NOT NULL DEFAULT 0,
+    memory_count INTEGER NOT NULL DEFAULT 0,
+    min_occurred_at TIMESTAMP,
+    max_occurred_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, month)
+);
+CREATE INDEX IF NOT EXISTS idx_archive_segments_user ON archive_segments(user_id);
+
+-- Per-shard high-water mark of issued user ids (never decreases)
+CREATE TABLE IF NOT EXISTS id_allocators (
+    name VARCHAR(32) PRIMARY KEY,
+    last_id BIGINT NOT NULL
+);
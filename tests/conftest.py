@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Settings and engines are built at import time: configure a throwaway two-shard deployment first
+_TMP = tempfile.mkdtemp(prefix="mem0chat-tests-")
+os.environ.update(
+    STORAGE_DIR=_TMP,
+    DATABASE_URL=f"sqlite:///{_TMP}/shard0.db",
+    DATABASE_SHARD_URLS=f"sqlite:///{_TMP}/shard0.db,sqlite:///{_TMP}/shard1.db",
+    OUTBOUND_SENDER_ENABLED="false",
+    RECENT_CACHE_VERIFY="true",
+)
+for _name in ("MEM0_API_KEY", "TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "TWILIO_WHATSAPP_NUMBER", "TWILIO_API_BASE_URL"):
+    os.environ.pop(_name, None)
+
+import pytest  # noqa: E402
+
+from app.config import get_settings  # noqa: E402
+from app.database import Base, shard_router, shards  # noqa: E402
+from app.main import app  # noqa: E402
+from app.services import twilio_messaging  # noqa: E402
+from app.services.recent_cache import recent_memory_cache  # noqa: E402
+from app.services.text_dedup import text_fingerprint_index  # noqa: E402
+from app.services.write_coordinator import close_write_coordinators  # noqa: E402
+
+
+def run(coro):
+    # Each test drives its own event loop; pooled aiosqlite connections and coordinator
+    # workers are bound to it, so release them before the loop closes
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await close_write_coordinators()
+            for shard in shards:
+                await shard.async_engine.dispose()
+
+    return asyncio.run(wrapper())
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    for shard in shards:
+        Base.metadata.drop_all(bind=shard.engine)
+        Base.metadata.create_all(bind=shard.engine)
+    if os.path.exists(shard_router.directory_path):
+        os.remove(shard_router.directory_path)
+    shard_router._directory = {"users": {}, "ids": {}}
+    shard_router._mtime = None
+    with recent_memory_cache._lock:
+        recent_memory_cache._users.clear()
+        recent_memory_cache._total_bytes = 0
+        recent_memory_cache._counters.clear()
+    for user_id in list(text_fingerprint_index._users):
+        text_fingerprint_index.invalidate(user_id)
+    yield
+
+
+@pytest.fixture
+def client():
+    import httpx
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver")
+
+
+class TwilioStandIn:
+    # Minimal Messages API: answers with the scripted statuses in order, then 201
+    def __init__(self) -> None:
+        self.statuses: list[int] = []
+        self.requests: list[dict] = []
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                with standin._lock:
+                    status = standin.statuses.pop(0) if standin.statuses else 201
+                    sid = f"SM{len(standin.requests):032d}"
+                    standin.requests.append({"path": self.path, "form": form, "status": status, "at": time.monotonic()})
+                if status < 300:
+                    payload = {"sid": sid, "status": "queued", "to": form.get("To"), "from": form.get("From"), "body": form.get("Body")}
+                else:
+                    payload = {"code": 20000 + status, "message": f"stand-in error {status}", "status": status}
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def twilio_standin(monkeypatch):
+    standin = TwilioStandIn()
+    standin.start()
+    settings = get_settings()
+    monkeypatch.setattr(settings, "twilio_account_sid", "AC" + "0" * 32)
+    monkeypatch.setattr(settings, "twilio_auth_token", "test-token")
+    monkeypatch.setattr(settings, "twilio_whatsapp_number", "whatsapp:+15550000000")
+    monkeypatch.setattr(settings, "twilio_api_base_url", standin.base_url)
+    monkeypatch.setattr(settings, "outbound_rate_per_second", 1000.0)
+    monkeypatch.setattr(settings, "outbound_burst", 1000)
+    twilio_messaging._twilio_client.cache_clear()
+    twilio_messaging._sender_buckets.cache_clear()
+    yield standin
+    standin.stop()
+    twilio_messaging._twilio_client.cache_clear()
+    twilio_messaging._sender_buckets.cache_clear()
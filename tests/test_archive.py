@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta
+
+from app.database import db_session, shard_router
+from app.models import Interaction, Memory, User
+from app.services.archive import _append_records, _load_memories, archive_old_rows
+
+from conftest import run
+
+
+def _old_user(waid: str, count: int, days_ago: int = 400) -> int:
+    shard = shard_router.shard_for_whatsapp_id(waid)
+    with db_session(shard) as db:
+        user = User(whatsapp_user_id=waid, phone_number=f"whatsapp:+{waid}")
+        db.add(user)
+        db.flush()
+        for i in range(count):
+            when = datetime.utcnow() - timedelta(days=days_ago, minutes=i)
+            interaction = Interaction(user_id=user.id, twilio_message_sid=f"SM-{waid}-{i}", message_type="text", body_text=f"old {i}", occurred_at=when)
+            db.add(interaction)
+            db.flush()
+            db.add(Memory(user_id=user.id, interaction_id=interaction.id, memory_type="text", text=f"old memory {i}", created_at=when))
+        return user.id
+
+
+def test_plain_list_reads_archive_when_hot_table_is_short(client):
+    _old_user("2001", 12)
+    stats = archive_old_rows(horizon_days=180)
+    assert stats["memories"] == 12
+
+    async def scenario():
+        await client.post("/webhook", data={"WaId": "2001", "MessageSid": "SM-new", "Body": "fresh memory after archival"})
+        return (await client.post("/webhook", data={"WaId": "2001", "MessageSid": "SM-list", "Body": "/list"})).text
+
+    reply = run(scenario())
+    assert "fresh memory after archival" in reply
+    # Newest nine archived ones top up the single hot memory
+    assert all(f"old memory {i}<" in reply.replace("\n", "<") for i in range(9))
+    assert "old memory 9" not in reply
+    assert reply.count("(text)") == 10
+
+
+def test_archived_memories_with_reused_ids_are_kept(tmp_path):
+    path = os.path.join(tmp_path, "2026-01.jsonl.gz")
+    first = {
+        "occurred_at": "2026-01-02T10:00:00",
+        "interaction": {"id": 5, "twilio_message_sid": "SM-a"},
+        "memory": {"id": 5, "user_id": 1, "memory_type": "text", "text": "from the old shard", "created_at": "2026-01-02T10:00:00"},
+        "media_assets": [],
+    }
+    # Same memory id, assigned again after the user moved to another shard
+    second = {
+        "occurred_at": "2026-01-20T10:00:00",
+        "interaction": {"id": 5, "twilio_message_sid": "SM-b"},
+        "memory": {"id": 5, "user_id": 1, "memory_type": "text", "text": "from the new shard", "created_at": "2026-01-20T10:00:00"},
+        "media_assets": [],
+    }
+    _append_records(path, [first])
+    # A crash between the fsync and the row delete replays identical records
+    _append_records(path, [first, second])
+
+    memories = _load_memories([path], None, None)
+    assert [m.text for m in memories] == ["from the new shard", "from the old shard"]
+
+
+def test_limit_stops_at_newest_months(tmp_path):
+    paths = []
+    for month in ("2026-03", "2026-02", "2026-01"):
+        path = os.path.join(tmp_path, f"{month}.jsonl.gz")
+        _append_records(path, [{
+            "occurred_at": f"{month}-01T00:00:00",
+            "interaction": None,
+            "memory": {"id": int(month[-1]), "user_id": 1, "memory_type": "text", "text": month, "created_at": f"{month}-01T00:00:00"},
+            "media_assets": [],
+        }])
+        paths.append(path)
+    with open(paths[-1], "wb") as f:
+        f.write(b"not gzip")  # never opened: two months already satisfy the limit
+
+    assert [m.text for m in _load_memories(paths, None, None, limit=2)] == ["2026-03", "2026-02"]
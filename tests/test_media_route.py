@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+
+from app.config import get_settings
+from app.database import db_session
+from app.models import Interaction, MediaAsset, User
+from app.services.media import media_url
+
+from conftest import run
+
+
+def _stored_media() -> tuple[int, int]:
+    data = b"\x89PNG fake image bytes"
+    sha = hashlib.sha256(data).hexdigest()
+    path = os.path.join(get_settings().storage_dir, "media", f"{sha}.png")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    with db_session(0) as db:
+        user = User(whatsapp_user_id="5001")
+        db.add(user)
+        db.flush()
+        interaction = Interaction(user_id=user.id, twilio_message_sid="SM-media", message_type="media")
+        db.add(interaction)
+        db.flush()
+        asset = MediaAsset(interaction_id=interaction.id, local_path=path, content_type="image/png", sha256_hash=sha)
+        db.add(asset)
+        db.flush()
+        return user.id, asset.id
+
+
+def _get(client, url: str):
+    async def fetch():
+        return await client.get(url.replace(get_settings().public_base_url or "", ""))
+
+    return run(fetch())
+
+
+def test_unsigned_requests_are_refused_without_a_secret(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "media_signing_secret", None)
+    user_id, media_id = _stored_media()
+
+    assert _get(client, f"/media/{media_id}?user_id={user_id}").status_code == 403
+    assert _get(client, media_url(user_id, str(media_id))).status_code == 403
+
+
+def test_signed_url_cache_lifetime_is_capped_at_expiry(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "media_signing_secret", "test-secret")
+    user_id, media_id = _stored_media()
+
+    response = _get(client, media_url(user_id, str(media_id), ttl_seconds=600))
+    assert response.status_code == 200 and response.content == b"\x89PNG fake image bytes"
+    max_age = int(re.search(r"max-age=(\d+)", response.headers["cache-control"]).group(1))
+    assert response.headers["cache-control"].startswith("public,") and 590 <= max_age <= 600
+
+    assert _get(client, f"/media/{media_id}?user_id={user_id}").status_code == 403
+    assert _get(client, media_url(user_id, str(media_id), ttl_seconds=-1)).status_code == 403
+    # A signature for another user does not open this user's media
+    assert _get(client, media_url(user_id + 1, str(media_id)).replace(f"user_id={user_id + 1}", f"user_id={user_id}")).status_code == 403
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime, timedelta
+
+from app.config import get_settings
+from app.database import db_session
+from app.models import Interaction, OutboundMessage, User
+from app.services import twilio_messaging
+from app.services.twilio_messaging import OutboundSender, enqueue_whatsapp_message, send_whatsapp_message
+
+
+def _queue_message(body: str = "hello") -> tuple[int, int]:
+    with db_session(0) as db:
+        user = User(whatsapp_user_id="15551230000", phone_number="whatsapp:+15551230000")
+        db.add(user)
+        db.flush()
+        message = enqueue_whatsapp_message(db, user.phone_number, body, user_id=user.id)
+        db.flush()
+        return user.id, message.id
+
+
+def _message(message_id: int) -> OutboundMessage:
+    with db_session(0) as db:
+        return db.get(OutboundMessage, message_id)
+
+
+def _make_due(message_id: int) -> None:
+    with db_session(0) as db:
+        db.get(OutboundMessage, message_id).next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+
+
+def _outbound_interactions(user_id: int) -> list[Interaction]:
+    with db_session(0) as db:
+        return db.query(Interaction).filter(Interaction.user_id == user_id, Interaction.message_direction == "outbound").all()
+
+
+def test_server_error_is_retried_then_sent(twilio_standin):
+    user_id, message_id = _queue_message()
+    twilio_standin.statuses = [500]
+    sender = OutboundSender()
+
+    assert sender.drain_once() == 1
+    message = _message(message_id)
+    assert message.status == "queued"
+    assert message.attempts == 1
+    assert "500" in message.last_error or "stand-in error" in message.last_error
+    assert message.next_attempt_at > datetime.utcnow()
+    assert sender.drain_once() == 0  # backoff not elapsed yet
+
+    _make_due(message_id)
+    assert sender.drain_once() == 1
+    message = _message(message_id)
+    assert message.status == "sent"
+    assert message.attempts == 2
+    assert message.last_error is None
+    assert message.twilio_message_sid == f"SM{1:032d}"
+    assert len(twilio_standin.requests) == 2
+    assert twilio_standin.requests[-1]["form"]["Body"] == "hello"
+    assert twilio_standin.requests[-1]["path"].endswith("/Messages.json")
+
+    interactions = _outbound_interactions(user_id)
+    assert [i.twilio_message_sid for i in interactions] == [message.twilio_message_sid]
+
+
+def test_client_error_fails_permanently(twilio_standin):
+    user_id, message_id = _queue_message()
+    twilio_standin.statuses = [400]
+
+    assert OutboundSender().drain_once() == 1
+    message = _message(message_id)
+    assert message.status == "failed"
+    assert message.attempts == 1
+    assert _outbound_interactions(user_id) == []
+    _make_due(message_id)
+    assert OutboundSender().drain_once() == 0
+    assert len(twilio_standin.requests) == 1
+
+
+def test_expired_lease_is_taken_over(twilio_standin):
+    _, message_id = _queue_message()
+    # A worker claimed the row and died: `sending` with a lease still running is left alone...
+    with db_session(0) as db:
+        message = db.get(OutboundMessage, message_id)
+        message.status = "sending"
+        message.next_attempt_at = datetime.utcnow() + timedelta(seconds=60)
+    sender = OutboundSender()
+    assert sender.drain_once() == 0
+    assert twilio_standin.requests == []
+
+    # ...and picked up by another worker once the lease has expired
+    _make_due(message_id)
+    assert sender.drain_once() == 1
+    assert _message(message_id).status == "sent"
+    assert len(twilio_standin.requests) == 1
+
+
+def test_sender_paces_sends_with_token_bucket(twilio_standin, monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "outbound_rate_per_second", 10.0)
+    monkeypatch.setattr(settings, "outbound_burst", 1)
+    twilio_messaging._sender_buckets.cache_clear()
+    message_ids = [_queue_message(f"m{i}")[1] for i in range(4)]
+
+    assert OutboundSender().drain_once() == 4
+    assert all(_message(mid).status == "sent" for mid in message_ids)
+    times = [r["at"] for r in twilio_standin.requests]
+    # One token up front, then one every 100 ms
+    assert times[-1] - times[0] >= 0.25
+    assert all(b - a >= 0.07 for a, b in zip(times, times[1:]))
+
+
+def test_send_gives_up_when_rate_limited(twilio_standin, monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "outbound_rate_per_second", 0.01)
+    monkeypatch.setattr(settings, "outbound_burst", 1)
+    twilio_messaging._sender_buckets.cache_clear()
+
+    assert send_whatsapp_message("whatsapp:+15551230000", "first") is not None
+    started = time.monotonic()
+    assert send_whatsapp_message("whatsapp:+15551230000", "second", acquire_timeout=0.1) is None
+    assert time.monotonic() - started < 1.0
+    assert len(twilio_standin.requests) == 1
+    # Not dropped: left on the queue for the sender
+    with db_session(0) as db:
+        assert [m.status for m in db.query(OutboundMessage).order_by(OutboundMessage.id)] == ["sent", "queued"]
+
+
+def test_direct_send_goes_through_the_queue(twilio_standin):
+    with db_session(0) as db:
+        user = User(whatsapp_user_id="15551230000", phone_number="whatsapp:+15551230000")
+        db.add(user)
+        db.flush()
+        user_id = user.id
+    twilio_standin.statuses = [503]
+
+    assert send_whatsapp_message("whatsapp:+15551230000", "reminder") is None
+    with db_session(0) as db:
+        (message,) = db.query(OutboundMessage).all()
+        message_id = message.id
+        assert (message.status, message.attempts, message.user_id) == ("queued", 1, user_id)
+
+    _make_due(message_id)
+    assert OutboundSender().drain_once() == 1
+    sid = _message(message_id).twilio_message_sid
+    assert [i.twilio_message_sid for i in _outbound_interactions(user_id)] == [sid]
+
+
+def test_failed_client_build_is_not_cached(twilio_standin, monkeypatch):
+    original = twilio_messaging._build_http_client
+
+    def broken():
+        raise RuntimeError("pool setup failed")
+
+    monkeypatch.setattr(twilio_messaging, "_build_http_client", broken)
+    assert twilio_messaging.get_twilio_client() is None
+    monkeypatch.setattr(twilio_messaging, "_build_http_client", original)
+    assert twilio_messaging.get_twilio_client() is not None
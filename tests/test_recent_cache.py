@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import itertools
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app.config import get_settings
+from app.database import db_session, shard_router
+from app.models import Memory, User
+from app.routers import webhook
+from app.services.recent_cache import RecentMemoryCache, recent_memory_cache
+
+from conftest import run
+
+_sids = itertools.count()
+_WORDS = ["apple", "river", "candle", "violin", "garden", "rocket", "pepper", "marble", "forest", "tunnel", "saddle", "harbor"]
+
+
+def _text(i: int) -> str:
+    return f"note {i}: {_WORDS[i % len(_WORDS)]} {_WORDS[(i * 5 + 3) % len(_WORDS)]} number {i * 7919}"
+
+
+async def _send(client, waid: str, body: str) -> str:
+    response = await client.post("/webhook", data={"WaId": waid, "MessageSid": f"SM{next(_sids)}", "Body": body})
+    return response.text
+
+
+def _user(waid: str) -> tuple[int, int]:
+    shard = shard_router.shard_for_whatsapp_id(waid)
+    with db_session(shard) as db:
+        return shard, db.execute(select(User.id).where(User.whatsapp_user_id == waid)).scalar_one()
+
+
+def _insert_behind_cache(waid: str, text: str) -> Memory:
+    # A write committed by another worker: this process's cache never hears about it
+    shard, user_id = _user(waid)
+    with db_session(shard) as db:
+        memory = Memory(user_id=user_id, memory_type="text", text=text, created_at=datetime.utcnow())
+        db.add(memory)
+        db.flush()
+        return memory
+
+
+def _assert_verified_clean():
+    stats = recent_memory_cache.stats()
+    assert stats.get("mismatches", 0) == 0, stats
+
+
+def test_ingest_keeps_warm_ring_current(client):
+    async def scenario():
+        for i in range(3):
+            assert "Memory saved" in await _send(client, "1001", _text(i))
+        first = await _send(client, "1001", "/list")
+        assert "Memory saved" in await _send(client, "1001", _text(3))
+        second = await _send(client, "1001", "/list")
+        return first, second
+
+    first, second = run(scenario())
+    assert "note 0:" in first and "note 3:" not in first
+    assert "note 3:" in second
+    stats = recent_memory_cache.stats()
+    assert stats["hits"] == 1 and stats["verified"] == 1
+    _assert_verified_clean()
+
+
+def test_cold_miss_lists_newest_ten(client):
+    async def scenario():
+        for i in range(12):
+            await _send(client, "1002", _text(i))
+        return await _send(client, "1002", "/list"), await _send(client, "1002", "/list")
+
+    cold, warm = run(scenario())
+    assert cold == warm
+    assert "note 0:" not in cold and "note 1:" not in cold and "note 11:" in cold
+    assert cold.count("(text)") == 10
+    _assert_verified_clean()
+
+
+def test_delete_invalidates_ring(client):
+    async def warm():
+        for i in range(2):
+            await _send(client, "1003", _text(i))
+        return await _send(client, "1003", "/list")
+
+    assert "note 1:" in run(warm())
+    shard, user_id = _user("1003")
+    with db_session(shard) as db:
+        victim = db.execute(select(Memory).where(Memory.user_id == user_id, Memory.text == _text(1))).scalar_one()
+        db.delete(victim)
+
+    async def relist():
+        return await _send(client, "1003", "/list")
+
+    reply = run(relist())
+    assert "note 1:" not in reply and "note 0:" in reply
+    assert recent_memory_cache.stats()["invalidations"] >= 1
+    _assert_verified_clean()
+
+
+def test_evicted_user_is_refilled(client, monkeypatch):
+    async def warm(waid: str, offset: int):
+        for i in range(offset, offset + 3):
+            await _send(client, waid, _text(i))
+        return await _send(client, waid, "/list")
+
+    async def scenario():
+        first = await warm("1004", 0)
+        # Room for roughly one user's ring
+        monkeypatch.setattr(recent_memory_cache, "max_bytes", recent_memory_cache.stats()["bytes"] + 100)
+        await warm("1005", 3)
+        return first, await _send(client, "1004", "/list")
+
+    first, again = run(scenario())
+    assert first == again
+    stats = recent_memory_cache.stats()
+    assert stats["evictions"] >= 1
+    _assert_verified_clean()
+
+
+def test_cold_fill_racing_ingest_is_not_cached(client, monkeypatch):
+    original = webhook._recent_memories
+    raced = []
+
+    async def slow_read(db, user_id):
+        memories = await original(db, user_id)
+        if not raced:
+            # Another request commits a memory between our DB read and the fill
+            memory = _insert_behind_cache("1006", "written during the cold read")
+            recent_memory_cache.push(user_id, memory)
+            raced.append(memory)
+        return memories
+
+    monkeypatch.setattr(webhook, "_recent_memories", slow_read)
+
+    async def scenario():
+        await _send(client, "1006", _text(0))
+        return await _send(client, "1006", "/list"), await _send(client, "1006", "/list")
+
+    racing, later = run(scenario())
+    assert "written during the cold read" not in racing
+    assert "written during the cold read" in later
+    assert recent_memory_cache.stats()["stale_fills"] == 1
+    _assert_verified_clean()
+
+
+def test_ttl_bounds_staleness_from_other_workers(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "recent_cache_verify", False)
+
+    async def send(body):
+        return await _send(client, "1007", body)
+
+    run(send(_text(0)))
+    run(send("/list"))
+    _insert_behind_cache("1007", "saved by another worker")
+    assert "saved by another worker" not in run(send("/list"))
+
+    monkeypatch.setattr(recent_memory_cache, "ttl_seconds", 0.0)
+    assert "saved by another worker" in run(send("/list"))
+    assert recent_memory_cache.stats()["expired"] == 1
+
+
+def test_generation_survives_bookkeeping_eviction():
+    cache = RecentMemoryCache(per_user=10, max_bytes=1 << 20, ttl_seconds=60, max_generations=1)
+    memory = Memory(id=1, user_id=1, memory_type="text", text="hello", created_at=datetime.utcnow())
+    generation = cache.generation(1)
+    cache.push(1, memory)
+    cache.push(2, memory)  # evicts user 1's generation entry
+    cache.fill(1, [], generation)
+    assert cache.get_reply(1) is None
+    assert cache.stats()["stale_fills"] == 1
+
+    generation = cache.generation(1)
+    cache.fill(1, [memory], generation)
+    assert "hello" in cache.get_reply(1)
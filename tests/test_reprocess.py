@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import io
+import os
+
+from PIL import Image
+from sqlalchemy.exc import IntegrityError
+
+from app.config import get_settings
+from app.database import db_session
+from app.models import Interaction, MediaAsset, Memory, User
+from app.services import reprocess
+
+
+def _image_file(name: str, color: tuple[int, int, int], size: tuple[int, int]) -> tuple[str, str]:
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, format="PNG")
+    data = buf.getvalue()
+    path = os.path.join(get_settings().storage_dir, "media", name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path, hashlib.sha256(data).hexdigest()
+
+
+def _media_rows(specs: list[tuple[str, str]]) -> list[int]:
+    # (local_path, stored sha256) -> MediaAsset ids on shard 0, without dimensions
+    with db_session(0) as db:
+        user = User(whatsapp_user_id="3001")
+        db.add(user)
+        db.flush()
+        ids = []
+        for i, (path, sha) in enumerate(specs):
+            interaction = Interaction(user_id=user.id, twilio_message_sid=f"SM-img-{i}", message_type="media")
+            db.add(interaction)
+            db.flush()
+            asset = MediaAsset(interaction_id=interaction.id, local_path=path, content_type="image/png", sha256_hash=sha)
+            db.add(asset)
+            db.flush()
+            ids.append(asset.id)
+        return ids
+
+
+def _media(media_id: int) -> MediaAsset:
+    with db_session(0) as db:
+        return db.get(MediaAsset, media_id)
+
+
+def test_image_metadata_skips_colliding_hashes():
+    red, red_sha = _image_file("red.png", (255, 0, 0), (4, 3))
+    red_copy, _ = _image_file("red-copy.png", (255, 0, 0), (4, 3))
+    blue, blue_sha = _image_file("blue.png", (0, 0, 255), (2, 5))
+    hashed, duplicate, dims_only = _media_rows([(red, red_sha), (red_copy, ""), (blue, blue_sha)])
+
+    stats = reprocess.run_task("image_metadata", workers=1, restart=True)
+
+    assert stats["processed"] == 3 and stats["failed"] == 0
+    assert (_media(hashed).width_px, _media(hashed).sha256_hash) == (4, red_sha)
+    # Same bytes as an existing row: dimensions only, the hash stays empty
+    assert (_media(duplicate).width_px, _media(duplicate).height_px, _media(duplicate).sha256_hash) == (4, 3, "")
+    assert (_media(dims_only).height_px, _media(dims_only).sha256_hash) == (5, blue_sha)
+    assert reprocess.load_checkpoint("image_metadata")["shards"]["0"]["last_id"] == dims_only
+
+
+def test_integrity_error_fails_the_batch_not_the_run(monkeypatch):
+    red, red_sha = _image_file("red.png", (255, 0, 0), (4, 3))
+    (media_id,) = _media_rows([(red, red_sha)])
+
+    def conflicting(db, results):
+        raise IntegrityError("UPDATE media_assets", {}, Exception("UNIQUE constraint failed"))
+
+    monkeypatch.setitem(reprocess.TASKS, "image_metadata", dataclasses.replace(reprocess.TASKS["image_metadata"], write_back=conflicting))
+    stats = reprocess.run_task("image_metadata", workers=1, restart=True)
+
+    assert stats["processed"] == 1 and stats["failed"] == 1 and stats["updated"] == 0
+    assert _media(media_id).width_px is None
+    assert reprocess.load_checkpoint("image_metadata")["shards"]["0"]["last_id"] == media_id
+
+
+def test_deferred_audio_reaches_mem0_only_with_its_transcript():
+    with db_session(0) as db:
+        user = User(whatsapp_user_id="3002")
+        db.add(user)
+        db.flush()
+        ids = {}
+        for key, memory_type, text, mem0_id in (
+            ("text", "text", "plain note", None),
+            ("deferred", "audio", "", None),
+            ("synced_empty", "audio", None, "mem0-without-text"),
+        ):
+            interaction = Interaction(user_id=user.id, twilio_message_sid=f"SM-{key}", message_type="media")
+            db.add(interaction)
+            db.flush()
+            memory = Memory(user_id=user.id, interaction_id=interaction.id, memory_type=memory_type, text=text, mem0_id=mem0_id)
+            db.add(memory)
+            db.flush()
+            ids[key] = memory.id
+
+    def mem0_pending() -> dict[int, str]:
+        with db_session(0) as db:
+            return {item["id"]: item["text"] for item in reprocess._select_mem0(db, 0, 10)}
+
+    assert mem0_pending() == {ids["text"]: "plain note"}
+
+    with db_session(0) as db:
+        transcripts = [
+            {"b_id": ids[key], "b_text": f"transcript {key}", "b_text_simhash": None, "b_duration": None, "b_media_id": 0}
+            for key in ("deferred", "synced_empty")
+        ]
+        assert reprocess._write_transcripts(db, transcripts) == 2
+
+    assert mem0_pending() == {
+        ids["text"]: "plain note",
+        ids["deferred"]: "transcript deferred",
+        ids["synced_empty"]: "transcript synced_empty",
+    }
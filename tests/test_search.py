@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from app.database import db_session, shards
+from app.models import Memory, User
+from app.services import search
+from app.services.admission import StageSaturated, admission_controller_singleton
+from app.services.mem0_client import mem0_client_singleton
+from app.services.search import hedged_search, search_stats
+
+from conftest import run
+
+
+def _user_with_memories() -> tuple[User, dict[str, int]]:
+    # Oldest first; "tagged" is a tag-mode near-duplicate sharing the Mem0 id of "bike"
+    specs = [
+        ("bike", "bike lock code is 4411", "m-bike"),
+        ("tagged", "bike lock code is 4411!", "m-bike"),
+        ("garage", "garage door code is 9027", "m-garage"),
+        ("wifi", "wifi code at the cabin is alpine", None),
+        ("unrelated", "buy oat milk", "m-milk"),
+    ]
+    with db_session(0) as db:
+        user = User(whatsapp_user_id="6001")
+        db.add(user)
+        db.flush()
+        ids = {}
+        for i, (key, text, mem0_id) in enumerate(specs):
+            memory = Memory(user_id=user.id, memory_type="text", text=text, mem0_id=mem0_id, created_at=datetime.utcnow() - timedelta(minutes=10 - i))
+            db.add(memory)
+            db.flush()
+            ids[key] = memory.id
+        db.expunge(user)
+    return user, ids
+
+
+def _stub_mem0(monkeypatch, results: list[dict], delay: float = 0.0) -> list[float]:
+    calls = []
+
+    def fake_search(user_external_id: str, query: str) -> list[dict]:
+        calls.append(time.monotonic())
+        time.sleep(delay)
+        return results
+
+    monkeypatch.setattr(mem0_client_singleton, "is_configured", lambda: True)
+    monkeypatch.setattr(mem0_client_singleton, "search", fake_search)
+    return calls
+
+
+def _search(user: User, query: str, **kwargs):
+    async def go():
+        async with shards[0].async_session_factory() as db:
+            return await hedged_search(db, user, query, **kwargs)
+
+    return run(go())
+
+
+def _counter_delta(before: dict, outcome: str) -> int:
+    return search_stats.snapshot()["counters"].get(outcome, 0) - before.get(outcome, 0)
+
+
+def test_fast_mem0_ranking_leads_and_is_deduplicated(monkeypatch):
+    user, ids = _user_with_memories()
+    _stub_mem0(monkeypatch, [{"id": "m-garage", "score": 0.9}, {"id": "m-bike", "score": 0.7}, {"id": "m-unknown"}])
+    before = search_stats.snapshot()["counters"]
+
+    result = _search(user, "code", limit=5, deadline_ms=2000)
+
+    assert result.backend == "mem0"
+    # Mem0 order first (the near-duplicate collapses into its newest row), then local hits not already present
+    assert [hit.memory.id for hit in result.hits] == [ids["garage"], ids["tagged"], ids["wifi"]]
+    assert [hit.score for hit in result.hits] == [0.9, 0.7, None]
+    assert _counter_delta(before, "mem0") == 1
+
+
+def test_slow_mem0_misses_the_deadline(monkeypatch):
+    user, ids = _user_with_memories()
+    _stub_mem0(monkeypatch, [{"id": "m-milk"}], delay=0.5)
+    before = search_stats.snapshot()["counters"]
+
+    started = time.monotonic()
+    result = _search(user, "wifi code", limit=2, deadline_ms=50)
+
+    assert time.monotonic() - started < 0.4
+    assert result.backend == "local"
+    # Both terms match "wifi" first; the late Mem0 answer ("m-milk") is never used
+    assert [hit.memory.id for hit in result.hits][0] == ids["wifi"]
+    assert ids["unrelated"] not in [hit.memory.id for hit in result.hits]
+    assert _counter_delta(before, "local_mem0_late") == 1
+
+
+def test_empty_mem0_answer_and_shed_mem0_are_told_apart(monkeypatch):
+    user, ids = _user_with_memories()
+    calls = _stub_mem0(monkeypatch, [])
+    before = search_stats.snapshot()["counters"]
+
+    assert _search(user, "garage", deadline_ms=2000).backend == "local"
+    assert _counter_delta(before, "local_mem0_empty") == 1
+
+    @asynccontextmanager
+    async def saturated(name: str, wait_seconds=None):
+        raise StageSaturated(name)
+        yield
+
+    monkeypatch.setattr(admission_controller_singleton, "stage", saturated)
+    result = _search(user, "garage", deadline_ms=2000)
+
+    assert result.backend == "local" and [hit.memory.id for hit in result.hits] == [ids["garage"]]
+    assert _counter_delta(before, "local_mem0_shed") == 1
+    assert _counter_delta(before, "local_mem0_empty") == 1
+    assert len(calls) == 1
+
+
+def test_mem0_error_falls_back_to_local(monkeypatch):
+    user, ids = _user_with_memories()
+    monkeypatch.setattr(mem0_client_singleton, "is_configured", lambda: True)
+
+    def broken(user_external_id: str, query: str):
+        raise ConnectionError("mem0 down")
+
+    monkeypatch.setattr(mem0_client_singleton, "search", broken)
+    before = search_stats.snapshot()["counters"]
+
+    result = _search(user, "milk", deadline_ms=2000)
+
+    assert result.backend == "local" and [hit.memory.id for hit in result.hits] == [ids["unrelated"]]
+    assert _counter_delta(before, "local_mem0_error") == 1
+    assert search._merge(result.hits, result.hits, 5) == result.hits
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app.database import db_session, shard_router, shards
+from app.models import IdAllocator, Interaction, MediaAsset, Memory, OutboundMessage, User
+from app.services.twilio_messaging import OutboundSender
+from app.sharding import SHARD_ID_STRIDE
+from scripts import rebalance_shards
+from scripts.rebalance_shards import find_user_shard, move_user
+
+
+def _waid_on(shard_index: int, start: int = 0) -> str:
+    for n in itertools.count(start):
+        waid = f"1555{n:07d}"
+        if shard_router.hashed_shard(waid) == shard_index:
+            return waid
+
+
+def _create_user(shard_index: int, waid: str) -> int:
+    with db_session(shard_index) as db:
+        user = User(whatsapp_user_id=waid)
+        db.add(user)
+        db.flush()
+        db.add(Memory(user_id=user.id, memory_type="text", text=f"memory of {waid}"))
+        return user.id
+
+
+def _all_user_ids() -> dict[int, int]:
+    located: dict[int, int] = {}
+    for shard in shards:
+        with db_session(shard.index) as db:
+            for user_id in db.execute(select(User.id)).scalars():
+                assert user_id not in located, f"user id {user_id} exists on two shards"
+                located[user_id] = shard.index
+    return located
+
+
+def test_ids_stay_unique_when_users_move_into_and_out_of_shard_zero():
+    assert len(shards) == 2
+    on_zero = _create_user(0, _waid_on(0))
+    on_one = _create_user(1, _waid_on(1))
+    assert on_zero == 1
+    assert on_one == SHARD_ID_STRIDE + 1
+
+    # Into shard 0 and out of shard 0
+    assert move_user(on_one, 0, settle_seconds=0)["moved"]
+    assert move_user(on_zero, 1, settle_seconds=0)["moved"]
+    assert find_user_shard(on_one) == 0 and find_user_shard(on_zero) == 1
+
+    new_zero = _create_user(0, _waid_on(0, 1000))
+    new_one = _create_user(1, _waid_on(1, 1000))
+    # Neither the moved-in id's neighbour nor the moved-out id is handed out again
+    assert new_zero == 2
+    assert new_one == SHARD_ID_STRIDE + 2
+
+    # Moving back does not rewind the high-water marks either
+    assert move_user(on_one, 1, settle_seconds=0)["moved"]
+    assert _create_user(1, _waid_on(1, 2000)) == SHARD_ID_STRIDE + 3
+    assert _create_user(0, _waid_on(0, 2000)) == 3
+
+    for user_id, shard_index in _all_user_ids().items():
+        assert shard_router.shard_for_user_id(user_id) == shard_index
+        with db_session(shard_index) as db:
+            assert db.execute(select(Memory.id).where(Memory.user_id == user_id)).first() is not None
+
+
+def test_moved_away_max_id_is_reserved_without_allocator_row():
+    # A shard created before the allocator existed has no high-water row yet
+    user_id = _create_user(1, _waid_on(1))
+    with db_session(1) as db:
+        db.execute(IdAllocator.__table__.delete())
+    assert move_user(user_id, 0, settle_seconds=0)["moved"]
+    assert _create_user(1, _waid_on(1, 1000)) == user_id + 1
+
+
+def _add_message(shard_index: int, user_id: int, sid: str, sha256: str = None) -> None:
+    with db_session(shard_index) as db:
+        interaction = Interaction(user_id=user_id, twilio_message_sid=sid, message_type="media" if sha256 else "text")
+        db.add(interaction)
+        db.flush()
+        if sha256:
+            db.add(MediaAsset(interaction_id=interaction.id, local_path=f"/media/{sha256}", content_type="image/png", sha256_hash=sha256))
+        db.add(Memory(user_id=user_id, interaction_id=interaction.id, memory_type="text", text=f"memory {sid}"))
+
+
+def _user_rows(shard_index: int, user_id: int) -> dict[str, list]:
+    with db_session(shard_index) as db:
+        interactions = db.execute(select(Interaction).where(Interaction.user_id == user_id)).scalars().all()
+        return {
+            "users": db.execute(select(User.id).where(User.id == user_id)).scalars().all(),
+            "interactions": sorted(i.twilio_message_sid for i in interactions),
+            "memories": sorted(db.execute(select(Memory.text).where(Memory.user_id == user_id)).scalars()),
+            "media": sorted(db.execute(select(MediaAsset.sha256_hash).where(MediaAsset.interaction_id.in_([i.id for i in interactions]))).scalars()),
+            "outbound": sorted(db.execute(select(OutboundMessage.body, OutboundMessage.status).where(OutboundMessage.user_id == user_id)).all()),
+        }
+
+
+def test_write_landing_after_the_delta_pass_is_not_deleted(monkeypatch):
+    user_id = _create_user(1, _waid_on(1))
+    _add_message(1, user_id, "SM-before", sha256="a" * 64)
+    original = rebalance_shards._copy_rows
+    passes = []
+
+    def copy_then_race(user_id, source, target, state):
+        counts = original(user_id, source, target, state)
+        passes.append(counts)
+        if len(passes) == 2:
+            # A request routed to the source before the pin commits only now
+            _add_message(source, user_id, "SM-late", sha256="b" * 64)
+        return counts
+
+    monkeypatch.setattr(rebalance_shards, "_copy_rows", copy_then_race)
+    result = move_user(user_id, 0, settle_seconds=0)
+
+    assert result["moved"] and result["delete_passes"] == 2
+    assert _user_rows(0, user_id)["interactions"] == ["SM-before", "SM-late"]
+    assert _user_rows(0, user_id)["media"] == ["a" * 64, "b" * 64]
+    assert "memory SM-late" in _user_rows(0, user_id)["memories"]
+    assert _user_rows(1, user_id) == {"users": [], "interactions": [], "memories": [], "media": [], "outbound": []}
+
+
+def test_pending_outbound_is_moved_once(monkeypatch, twilio_standin):
+    user_id = _create_user(1, _waid_on(1))
+    now = datetime.utcnow()
+    with db_session(1) as db:
+        for body, status, lease in (("sent", "sent", now), ("queued", "queued", now), ("stale", "sending", now - timedelta(minutes=5)), ("live", "sending", now + timedelta(minutes=1))):
+            db.add(OutboundMessage(user_id=user_id, to_phone="whatsapp:+15550001", from_phone="whatsapp:+15550000", body=body, status=status, next_attempt_at=lease))
+
+    sleeps = []
+
+    def source_sender_finishes(seconds):
+        # The source's sender still holds the live lease; it delivers the row while the move waits
+        sleeps.append(seconds)
+        if seconds:
+            with db_session(1) as db:
+                db.execute(OutboundMessage.__table__.update().where(OutboundMessage.body == "live").values(status="sent"))
+
+    monkeypatch.setattr(rebalance_shards.time, "sleep", source_sender_finishes)
+    assert move_user(user_id, 0, settle_seconds=0)["moved"]
+
+    assert _user_rows(0, user_id)["outbound"] == [("live", "sent"), ("queued", "queued"), ("sent", "sent"), ("stale", "queued")]
+    assert _user_rows(1, user_id)["outbound"] == []
+    with db_session(0) as db:
+        db.execute(OutboundMessage.__table__.update().values(next_attempt_at=now - timedelta(seconds=1)))
+    assert OutboundSender().drain_once() == 2
+    assert sorted(r["form"]["Body"] for r in twilio_standin.requests) == ["queued", "stale"]
+
+
+def test_move_refuses_media_already_on_target():
+    user_id = _create_user(1, _waid_on(1))
+    _add_message(1, user_id, "SM-photo", sha256="c" * 64)
+    other = _create_user(0, _waid_on(0))
+    _add_message(0, other, "SM-same-photo", sha256="c" * 64)
+
+    with pytest.raises(SystemExit, match="already stored on shard 0"):
+        move_user(user_id, 0, settle_seconds=0)
+
+    assert find_user_shard(user_id) == 1 and shard_router.shard_for_user_id(user_id) == 1
+    assert _user_rows(1, user_id)["media"] == ["c" * 64]
+    assert _user_rows(0, user_id)["users"] == []
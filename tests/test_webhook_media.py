@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import io
+import json
+
+from PIL import Image
+from sqlalchemy import func, select
+
+from app.config import get_settings
+from app.database import shard_router, shards
+from app.models import MediaAsset, Memory
+from app.routers import webhook
+from app.services.mem0_client import mem0_client_singleton
+
+from conftest import run
+
+
+def _png(size: int, shade: int) -> bytes:
+    img = Image.new("RGB", (size, size), (shade, shade, shade))
+    for x in range(size // 2):
+        for y in range(size):
+            img.putpixel((x, y), (255 - shade, 0, 0))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _checkerboard(size: int) -> bytes:
+    img = Image.new("RGB", (size, size))
+    for x in range(size):
+        for y in range(size):
+            img.putpixel((x, y), (0, 0, 255) if (x // 8 + y // 8) % 2 else (255, 255, 0))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _media_count(shard_index: int) -> int:
+    with shards[shard_index].session_factory() as db:
+        return db.execute(select(func.count(MediaAsset.id))).scalar()
+
+
+def test_resized_image_is_deduplicated_off_the_event_loop(client, monkeypatch):
+    downloads = {"https://media/1": (_png(64, 40), "image/png"), "https://media/2": (_png(128, 40), "image/png")}
+    monkeypatch.setattr(webhook, "download_twilio_media", lambda url: downloads[url])
+
+    async def scenario():
+        async with client:
+            first = await client.post(
+                "/webhook", data={"WaId": "15550001111", "MessageSid": "SM1", "NumMedia": "1", "MediaUrl0": "https://media/1"}
+            )
+            second = await client.post(
+                "/webhook", data={"WaId": "15550001111", "MessageSid": "SM2", "NumMedia": "1", "MediaUrl0": "https://media/2"}
+            )
+            return first.text, second.text
+
+    first, second = run(scenario())
+    assert "Memory saved" in first
+    assert "already saved" in second
+    assert _media_count(shard_router.shard_for_whatsapp_id("15550001111")) == 1
+
+
+def test_same_caption_on_different_photos_keeps_both(client, monkeypatch):
+    downloads = {"https://media/a": (_png(64, 40), "image/png"), "https://media/b": (_checkerboard(64), "image/png")}
+    monkeypatch.setattr(webhook, "download_twilio_media", lambda url: downloads[url])
+
+    async def scenario():
+        replies = []
+        for sid, url in (("SM-a", "https://media/a"), ("SM-b", "https://media/b")):
+            form = {"WaId": "15550002222", "MessageSid": sid, "Body": "receipt for my car", "NumMedia": "1", "MediaUrl0": url}
+            replies.append((await client.post("/webhook", data=form)).text)
+        return replies
+
+    replies = run(scenario())
+    assert all("Memory saved" in reply for reply in replies)
+    shard = shard_router.shard_for_whatsapp_id("15550002222")
+    with shards[shard].session_factory() as db:
+        memories = db.execute(select(Memory).order_by(Memory.id)).scalars().all()
+        assert [(m.memory_type, m.labels_json, m.text_simhash) for m in memories] == [("image", None, None)] * 2
+    assert _media_count(shard) == 2
+
+
+def test_tagged_duplicate_gets_its_own_mem0_memory(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "text_dedup_mode", "tag")
+    created = []
+
+    def create_memory(**kwargs):
+        created.append(kwargs)
+        return f"mem0-{len(created)}"
+
+    monkeypatch.setattr(mem0_client_singleton, "create_memory", create_memory)
+
+    async def scenario():
+        for sid, body in (("SM-1", "Dentist appointment on Friday at 3pm with Dr Lee"), ("SM-2", "Dentist appointment on Friday at 3pm with Dr. Lee")):
+            assert "Memory saved" in (await client.post("/webhook", data={"WaId": "15550003333", "MessageSid": sid, "Body": body})).text
+
+    run(scenario())
+    with shards[shard_router.shard_for_whatsapp_id("15550003333")].session_factory() as db:
+        first, second = db.execute(select(Memory).order_by(Memory.id)).scalars().all()
+    assert (first.mem0_id, second.mem0_id) == ("mem0-1", "mem0-2")
+    assert json.loads(second.labels_json) == [f"near-duplicate-of:{first.id}"]
+    assert created[1]["text"] == second.text and created[1]["labels"] == [f"near-duplicate-of:{first.id}"]
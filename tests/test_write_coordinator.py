@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from app.database import db_session, shards
+from app.models import Interaction, Memory, User
+from app.routers.webhook import _DuplicateMessage, _message_writer
+from app.services.write_coordinator import WriteCoordinator
+
+from conftest import run
+
+
+def _user() -> int:
+    with db_session(0) as db:
+        user = User(whatsapp_user_id="4001")
+        db.add(user)
+        db.flush()
+        return user.id
+
+
+def _writer(user_id: int, sid: str):
+    return _message_writer(user_id, sid, "text", sid, memory_fields={"memory_type": "text", "text": f"memory {sid}"})
+
+
+def _failing(exc: Exception):
+    async def job(session):
+        session.add(Interaction(user_id=0, twilio_message_sid="SM-never", message_type="text"))
+        await session.flush()
+        raise exc
+
+    return job
+
+
+def _rows() -> dict[str, int]:
+    with db_session(0) as db:
+        rows = db.execute(select(Interaction.twilio_message_sid, func.count()).group_by(Interaction.twilio_message_sid)).all()
+        memories = db.execute(select(func.count(Memory.id))).scalar()
+    return {"memories": memories, **dict(rows)}
+
+
+def _commit_fails_once(factory):
+    calls = []
+
+    def make():
+        session = factory()
+        if not calls:
+            calls.append(session)
+
+            async def commit():
+                raise OperationalError("COMMIT", {}, Exception("disk I/O error"))
+
+            session.commit = commit
+        return session
+
+    return make
+
+
+async def _submit_all(coordinator: WriteCoordinator, jobs: list) -> list:
+    try:
+        return await asyncio.gather(*(coordinator.submit(job) for job in jobs), return_exceptions=True)
+    finally:
+        await coordinator.close()
+
+
+def test_failing_and_duplicate_jobs_are_replayed_out_of_the_batch():
+    user_id = _user()
+    coordinator = WriteCoordinator(shards[0].async_session_factory, max_batch_size=10, max_wait_ms=50)
+    jobs = [_writer(user_id, "SM-a"), _failing(ValueError("bad job")), _writer(user_id, "SM-b"), _writer(user_id, "SM-a"), _writer(user_id, "SM-c")]
+
+    first, failed, second, duplicate, third = run(_submit_all(coordinator, jobs))
+
+    assert all(isinstance(result, Memory) for result in (first, second, third))
+    assert isinstance(failed, ValueError) and str(failed) == "bad job"
+    # The in-batch re-check sees SM-a flushed earlier in the same session
+    assert isinstance(duplicate, _DuplicateMessage)
+    assert _rows() == {"memories": 3, "SM-a": 1, "SM-b": 1, "SM-c": 1}
+    assert (coordinator.batches, coordinator.jobs) == (1, 3)
+
+
+def test_commit_failure_falls_back_to_one_transaction_per_job():
+    user_id = _user()
+    factory = _commit_fails_once(shards[0].async_session_factory)
+    coordinator = WriteCoordinator(factory, max_batch_size=10, max_wait_ms=50)
+    jobs = [_writer(user_id, "SM-a"), _writer(user_id, "SM-b"), _writer(user_id, "SM-c")]
+
+    results = run(_submit_all(coordinator, jobs))
+
+    assert all(isinstance(result, Memory) for result in results)
+    assert len({result.id for result in results}) == 3
+    assert _rows() == {"memories": 3, "SM-a": 1, "SM-b": 1, "SM-c": 1}
+    # Nothing was committed as a batch
+    assert coordinator.batches == 0
+
+
+def test_commit_failure_of_a_single_job_is_its_own_error():
+    user_id = _user()
+    coordinator = WriteCoordinator(_commit_fails_once(shards[0].async_session_factory), max_batch_size=10, max_wait_ms=50)
+
+    (result,) = run(_submit_all(coordinator, [_writer(user_id, "SM-a")]))
+
+    assert isinstance(result, OperationalError)
+    assert _rows() == {"memories": 0}
+    # Nothing was left behind: a retry of the same message is stored, not reported as a duplicate
+    (retry,) = run(_submit_all(coordinator, [_writer(user_id, "SM-a")]))
+    assert isinstance(retry, Memory)
+    assert _rows() == {"memories": 1, "SM-a": 1}